@@ -1,7 +1,12 @@
-from infoscreen.rules import InfoScreens
+import inspect
+
+from .rules import InfoScreen
 
 
 async def setup(bot):
-    c = InfoScreens(bot)
+    c = InfoScreen(bot)
     await c.init()
-    bot.add_cog(c)
+    # Red 3.5 made add_cog a coroutine.
+    result = bot.add_cog(c)
+    if inspect.isawaitable(result):
+        await result
@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+#: The most bytes of images kept in the disk cache.
+image_cache_size = 200 * 1024 * 1024
+
+#: The amount of seconds a cached image is used without asking its origin whether it changed.
+revalidate_after = 60 * 60
+
+
+class ImageCache:
+    """A size-bounded, content-addressed disk cache of raw images.
+
+    Images are stored once per SHA-256 of their content, so the same image used by several
+    guilds or under several URLs is stored once. Each URL remembers its image and the ETag and
+    Last-Modified headers it came with, which are used to revalidate it after `revalidate_after`
+    seconds. When the cache is full the least recently used image is evicted.
+    """
+
+    def __init__(self, path: Path, max_size=image_cache_size):
+        self.path = path
+        self.blobs = path / 'blobs'
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.index_path = path / 'index.json'
+        self.max_size = max_size
+        self.size = 0
+        self.urls: Dict[str, dict] = {}
+        # The size of every stored image by digest, least recently used first.
+        self._sizes = OrderedDict()
+        self.load()
+
+    def load(self):
+        if not self.index_path.exists():
+            return
+        with self.index_path.open() as f:
+            index = json.load(f)
+        for digest, size in index['blobs']:
+            if (self.blobs / digest).exists():
+                self._sizes[digest] = size
+                self.size += size
+        self.urls = {url: entry for url, entry in index['urls'].items() if entry['digest'] in self._sizes}
+
+    def save(self):
+        tmp = self.index_path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump({'urls': self.urls, 'blobs': list(self._sizes.items())}, f)
+        os.replace(str(tmp), str(self.index_path))
+
+    def lookup(self, url) -> Optional[dict]:
+        return self.urls.get(url)
+
+    @staticmethod
+    def is_fresh(entry):
+        return time.time() - entry['checked'] < revalidate_after
+
+    @staticmethod
+    def validators(entry):
+        """Returns the headers that ask the origin to only send an image if it changed."""
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def open(self, entry):
+        self._sizes.move_to_end(entry['digest'])
+        return (self.blobs / entry['digest']).open('rb')
+
+    def revalidated(self, entry):
+        entry['checked'] = time.time()
+        self.save()
+
+    def temp_file(self):
+        """Returns a file on the cache's disk to download a new image into before it is stored."""
+        return tempfile.NamedTemporaryFile(dir=str(self.path), delete=False)
+
+    def store(self, url, tmp_path, digest, size, etag=None, last_modified=None):
+        """Moves a downloaded image into the cache and returns its entry."""
+        if digest in self._sizes:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, str(self.blobs / digest))
+            self._sizes[digest] = size
+            self.size += size
+        self._sizes.move_to_end(digest)
+        entry = self.urls[url] = {
+            'digest': digest, 'etag': etag, 'last_modified': last_modified, 'checked': time.time()
+        }
+        self._evict()
+        self.save()
+        return entry
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._sizes) > 1:
+            digest, size = self._sizes.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(str(self.blobs / digest))
+            except OSError:
+                pass
+            self.urls = {url: entry for url, entry in self.urls.items() if entry['digest'] != digest}
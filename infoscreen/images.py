@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .imagecache import ImageCache
+
+#: The most bytes a raw image may have. Larger images are refused before they are downloaded.
+max_image_size = 8 * 1024 * 1024
+
+#: The amount of seconds a whole image download may take.
+image_timeout = 30
+
+#: The amount of seconds connecting to an image host may take.
+image_connect_timeout = 10
+
+#: The most image downloads that run at the same time.
+max_concurrent_downloads = 4
+
+#: Downloaded images larger than this many bytes are spooled to disk instead of kept in memory.
+spool_size = 1024 * 1024
+
+#: The chunk size images are read in.
+chunk_size = 64 * 1024
+
+
+class ImageError(Exception):
+    """An image could not be downloaded."""
+
+    def __init__(self, url, reason):
+        super().__init__('Could not fetch image %s: %s' % (url, reason))
+        self.url = url
+
+
+def filename_for(url):
+    """Returns the file name an image is uploaded under, keeping the extension of its URL."""
+    name = os.path.basename(urlparse(url).path)
+    return name if os.path.splitext(name)[1] else 'image.png'
+
+
+class ImageFetcher:
+    """Downloads raw images through one pooled HTTP session without blocking the event loop.
+
+    If a cache is given, images are served from it and only downloaded again when their
+    origin reports a change.
+    """
+
+    def __init__(self, cache: ImageCache = None, max_size=max_image_size,
+                 max_downloads=max_concurrent_downloads):
+        self.cache = cache
+        self.max_size = max_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(max_downloads)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=image_timeout, connect=image_connect_timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def fetch(self, url):
+        """Returns an image as a file object.
+
+        Without a cache the image is downloaded into a file that is spooled to disk if it is large.
+        """
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        if entry is not None and self.cache.is_fresh(entry):
+            return self.cache.open(entry)
+
+        async with self._semaphore:
+            try:
+                headers = self.cache.validators(entry) if entry is not None else {}
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status == 304 and entry is not None:
+                        self.cache.revalidated(entry)
+                        return self.cache.open(entry)
+                    if response.status != 200:
+                        raise ImageError(url, 'HTTP %d' % response.status)
+                    if (response.content_length or 0) > self.max_size:
+                        raise ImageError(url, 'larger than %d bytes' % self.max_size)
+                    if self.cache is None:
+                        fp = tempfile.SpooledTemporaryFile(max_size=spool_size)
+                        try:
+                            await self._read(url, response, fp)
+                        except BaseException:
+                            fp.close()
+                            raise
+                        fp.seek(0)
+                        return fp
+                    return await self._store(url, response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if entry is not None:
+                    # The origin is unreachable, so the image it last sent is the best there is.
+                    return self.cache.open(entry)
+                raise ImageError(url, e.__class__.__name__) from e
+
+    async def _read(self, url, response, fp, digest=None):
+        size = 0
+        async for chunk in response.content.iter_chunked(chunk_size):
+            size += len(chunk)
+            if size > self.max_size:
+                raise ImageError(url, 'larger than %d bytes' % self.max_size)
+            fp.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+        return size
+
+    async def _store(self, url, response):
+        digest = hashlib.sha256()
+        with self.cache.temp_file() as fp:
+            try:
+                size = await self._read(url, response, fp, digest)
+            except BaseException:
+                fp.close()
+                os.remove(fp.name)
+                raise
+        entry = self.cache.store(url, fp.name, digest.hexdigest(), size,
+                                 response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return self.cache.open(entry)
+
+    async def warm(self, urls: Iterable[str]):
+        """Makes sure images are in the cache, so the next send starts right away."""
+        for url in urls:
+            try:
+                (await self.fetch(url)).close()
+            except ImageError as e:
+                print(e)
+
+    async def fetch_all(self, urls: Iterable[str]) -> Dict[str, object]:
+        """Downloads a number of images concurrently. Closes the ones already downloaded if one fails."""
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        error = next((result for result in results if isinstance(result, BaseException)), None)
+        if error is not None:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    result.close()
+            raise error
+        return dict(zip(urls, results))
@@ -1,22 +1,64 @@
-import io
+import hashlib
+import json
+from typing import NamedTuple, Optional, Tuple
 
 import discord
-import requests
 
 from redbot.core import commands, Config, checks
+from redbot.core.data_manager import cog_data_path
+
+from .imagecache import ImageCache
+from .images import ImageError, ImageFetcher, filename_for
+from .store import ScreenStore
 
 INFO_TEXT = 'text'
 INFO_IMAGE = 'image'
 INFO_TEXT_BOX = 'textbox'
 INFO_LIST = 'list'
 
+MAX_CONTENT = 2000
+MAX_TITLE = 256
+MAX_DESCRIPTION = 4096
+MAX_FIELDS = 25
+MAX_FIELD_NAME = 256
+MAX_FIELD_VALUE = 1024
+MAX_EMBED = 6000
+MAX_EMBEDS = 10
+
+#: Whether the installed discord.py can send several embeds in one message.
+MULTIPLE_EMBEDS = discord.version_info.major >= 2
+
+#: The value of an unset embed attribute. discord.py 2 dropped `Embed.Empty` in favour of None.
+EMBED_EMPTY = getattr(discord.Embed, 'Empty', None)
+
+
+class ScreenError(Exception):
+    """An entry of an info screen breaks one of Discord's limits."""
+
+    def __init__(self, index, reason):
+        super().__init__('Entry %d %s.' % (index + 1, reason))
+        self.index = index
+
+
+class Payload(NamedTuple):
+    """A message, ready to send. Raw images only carry their URL, they are downloaded when sent."""
+    content: Optional[str] = None
+    embeds: Tuple[discord.Embed, ...] = ()
+    raw_url: Optional[str] = None
+
+    def message_kwargs(self):
+        """Returns the keyword arguments that send or edit this message's content and embeds."""
+        if MULTIPLE_EMBEDS:
+            return {'content': self.content, 'embeds': list(self.embeds)}
+        return {'content': self.content, 'embed': self.embeds[0] if self.embeds else None}
+
 
 def editor_check(editor, channel):
     return lambda m: m.channel == channel and m.author == editor
 
 
 def get_or_empty(d, k):
-    return d.get(k, discord.Embed.Empty)
+    return d.get(k, EMBED_EMPTY)
 
 
 def get_basic_embed(o):
@@ -55,6 +97,73 @@ def describe(element):
         return message
 
 
+def fingerprint(payload):
+    """Returns a digest that changes whenever what a payload looks like changes."""
+    data = {
+        'content': payload.content,
+        'embeds': [embed.to_dict() for embed in payload.embeds],
+        'raw_url': payload.raw_url
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def check_length(index, name, value, limit):
+    if value and len(value) > limit:
+        raise ScreenError(index, 'has a %s longer than %d characters' % (name, limit))
+
+
+def render(index, element):
+    """Renders an entry into a payload, raising `ScreenError` if Discord would refuse it."""
+    t = element['entry_type']
+    o = element['options']
+    if t == INFO_IMAGE:
+        if 'raw' in o and o['raw']:
+            return Payload(raw_url=o['url'])
+        return Payload(embeds=(discord.Embed(color=get_or_empty(o, 'color')).set_image(url=o['url']),))
+    elif t == INFO_TEXT:
+        if not o.get('text'):
+            raise ScreenError(index, 'has no text')
+        check_length(index, 'text', o['text'], MAX_CONTENT)
+        return Payload(content=o['text'])
+
+    embed = get_basic_embed(o)
+    check_length(index, 'title', o.get('title'), MAX_TITLE)
+    check_length(index, 'description', o.get('description'), MAX_DESCRIPTION)
+    if t == INFO_LIST:
+        if len(o['entries']) > MAX_FIELDS:
+            raise ScreenError(index, 'has more than %d list entries' % MAX_FIELDS)
+        for entry_index, entry in enumerate(o['entries']):
+            # Entries saved by older versions may have a missing title or description.
+            name = entry['name'] or ''
+            value = entry['value'] or ''
+            if 'enumerated' in o and o['enumerated']:
+                name = str(entry_index + 1) + '. ' + name
+            if not name.strip() or not value.strip():
+                raise ScreenError(index, 'has an empty list entry')
+            check_length(index, 'list entry title', name, MAX_FIELD_NAME)
+            check_length(index, 'list entry description', value, MAX_FIELD_VALUE)
+            embed.add_field(inline=False, name=name, value=value)
+    if len(embed) == 0:
+        raise ScreenError(index, 'is empty')
+    if len(embed) > MAX_EMBED:
+        raise ScreenError(index, 'is longer than %d characters in total' % MAX_EMBED)
+    return Payload(embeds=(embed,))
+
+
+def pack(payloads, max_embeds=MAX_EMBEDS if MULTIPLE_EMBEDS else 1):
+    """Merges runs of embeds, and a text right before them, into as few messages as Discord allows."""
+    messages = []
+    for payload in payloads:
+        last = messages[-1] if messages else None
+        if (last is not None and not last.raw_url and not payload.content and not payload.raw_url
+                and len(last.embeds) + len(payload.embeds) <= max_embeds
+                and sum(len(embed) for embed in last.embeds + payload.embeds) <= MAX_EMBED):
+            messages[-1] = last._replace(embeds=last.embeds + payload.embeds)
+        else:
+            messages.append(payload)
+    return messages
+
+
 async def get_answer(bot, channel, editor, *, allow_delete=True, strip=False, lower=False):
     msg = await bot.wait_for('message', check=editor_check(editor, channel))
     if allow_delete and msg.content.strip() == '!':
@@ -137,9 +246,9 @@ async def edit_list_entries(bot, channel, editor, entries):
                 if index is None:
                     continue
             await channel.send('Title:')
-            name = await get_answer(bot, channel, editor)
+            name = await get_answer(bot, channel, editor, allow_delete=False)
             await channel.send('Description:')
-            value = await get_answer(bot, channel, editor)
+            value = await get_answer(bot, channel, editor, allow_delete=False)
             entries.insert(index, {'name': name, 'value': value})
             await channel.send('The list entry has been added.')
         elif choice == 'e':
@@ -150,9 +259,9 @@ async def edit_list_entries(bot, channel, editor, entries):
             if index is None:
                 continue
             await channel.send('Title:')
-            name = await get_answer(bot, channel, editor)
+            name = await get_answer(bot, channel, editor, allow_delete=False)
             await channel.send('Description:')
-            value = await get_answer(bot, channel, editor)
+            value = await get_answer(bot, channel, editor, allow_delete=False)
             entries[index] = {'name': name, 'value': value}
             await channel.send('The list entry has been edited.')
         elif choice == 'd':
@@ -198,8 +307,9 @@ async def edit_list_entries(bot, channel, editor, entries):
 
 
 class BaseScreen:
-    def __init__(self, elements=list()):
-        self.elements = elements
+    def __init__(self, elements=None):
+        self.elements = elements if elements is not None else []
+        self._compiled = None
 
     def add(self, entry_type, index=None, **options):
         if index is None:
@@ -216,30 +326,88 @@ class BaseScreen:
     def describe_all(self):
         return [describe(element) for element in self.elements]
 
-    async def send(self, bot, destination):
-        for element in self.elements:
-            t = element['entry_type']
-            o = element['options']
-            if t == INFO_IMAGE:
-                if 'raw' not in o or not o['raw']:
-                    embed = discord.Embed(color=get_or_empty(o, 'color')).set_image(url=o['url'])
-                    await destination.send(None, embed=embed)
-                else:
-                    r = requests.get(o['url'])
-                    await destination.send(None, file=discord.File(io.BytesIO(r.content), "eh.jpg"))
-            elif t == INFO_TEXT:
-                await destination.send(o['text'])
-            elif t == INFO_TEXT_BOX:
-                embed = get_basic_embed(o)
-                await destination.send(None, embed=embed)
-            elif t == INFO_LIST:
-                embed = get_basic_embed(o)
-                for index, entry in enumerate(o['entries']):
-                    name = entry['name']
-                    if 'enumerated' in o and o['enumerated']:
-                        name = str(index + 1) + '. ' + name
-                    embed.add_field(inline=False, name=name, value=entry['value'])
-                await destination.send(None, embed=embed)
+    def raw_image_urls(self):
+        return [element['options']['url'] for element in self.elements
+                if element['entry_type'] == INFO_IMAGE and element['options'].get('raw')]
+
+    def invalidate(self):
+        """Drops the compiled screen. Must be called whenever the elements change."""
+        self._compiled = None
+
+    def compile(self):
+        """Renders the entries into messages once, raising `ScreenError` if one breaks Discord's limits.
+
+        Consecutive embeds share a message where the embed limits allow it.
+        """
+        if self._compiled is None:
+            self._compiled = tuple(pack([render(index, element) for index, element in enumerate(self.elements)]))
+        return self._compiled
+
+    async def send(self, bot, destination, images=None, published=(), trailing_id=None):
+        """Sends the screen, or updates a copy of it that was published in the destination before.
+
+        `published` is the copy as returned by an earlier send: a [message ID, fingerprint, raw]
+        list per message. Changed messages are edited in place, messages past the end of the screen
+        are deleted and new ones are appended. Raw images can not be edited, so everything from the
+        first changed raw image on is sent again. Appending is only done if nothing but the message
+        with ID `trailing_id` was posted after the copy, otherwise the whole screen is sent again.
+
+        Raw images are downloaded concurrently before anything is sent. Returns the new copy.
+        """
+        payloads = self.compile()
+        fingerprints = [fingerprint(payload) for payload in payloads]
+        published = [tuple(message) for message in published]
+
+        edits = []
+        cut = min(len(published), len(payloads))
+        for index in range(cut):
+            if published[index][1] == fingerprints[index]:
+                continue
+            if published[index][2] or payloads[index].raw_url:
+                cut = index
+                break
+            edits.append(index)
+        last_ids = (published[-1][0], trailing_id) if published else ()
+        if cut < len(payloads) and published and getattr(destination, 'last_message_id', None) not in last_ids:
+            edits, cut = [], 0
+
+        fetcher = images if images is not None else ImageFetcher()
+        try:
+            files = await fetcher.fetch_all(payload.raw_url for payload in payloads[cut:] if payload.raw_url)
+        finally:
+            if images is None:
+                await fetcher.close()
+        try:
+            try:
+                for index in edits:
+                    await destination.get_partial_message(published[index][0]).edit(
+                        **payloads[index].message_kwargs())
+            except discord.NotFound:
+                # Part of the copy was deleted by hand, so it is replaced as a whole.
+                edits, cut = [], 0
+                files.update(await fetcher.fetch_all(
+                    payload.raw_url for payload in payloads if payload.raw_url and payload.raw_url not in files))
+            for message_id, _, _ in published[cut:]:
+                try:
+                    await destination.get_partial_message(message_id).delete()
+                except discord.NotFound:
+                    pass
+            copy = [[published[index][0], fingerprints[index], bool(payloads[index].raw_url)] for index in range(cut)]
+            for payload, digest in zip(payloads[cut:], fingerprints[cut:]):
+                message = await self._send(destination, payload, files)
+                copy.append([message.id, digest, bool(payload.raw_url)])
+            return copy
+        finally:
+            for fp in files.values():
+                fp.close()
+
+    @staticmethod
+    async def _send(destination, payload, files):
+        if payload.raw_url:
+            fp = files[payload.raw_url]
+            fp.seek(0)
+            return await destination.send(None, file=discord.File(fp, filename_for(payload.raw_url)))
+        return await destination.send(**payload.message_kwargs())
 
     async def edit_entry(self, bot, channel, editor, index):
         entry = self.elements[index]
@@ -322,19 +490,19 @@ class InfoScreen(commands.Cog):
         self.bot = bot
         self.file_path = 'data/infoscreen/screens.json'
         self.config = Config.get_conf(self, identifier=1170348762)
-        self.config.register_global(screens={})
-        self.screens = {}
+        self.config.register_channel(published=[])
+        self.screens = ScreenStore(self.config, BaseScreen)
+        self.images = ImageFetcher(ImageCache(cog_data_path(self) / 'images'))
+
+    def cog_unload(self):
+        self.screens.close()
+        self.bot.loop.create_task(self.images.close())
 
     async def init(self):
-        raw_screens = await self.config.screens()
-        self.screens = {server_id: BaseScreen(elements) for server_id, elements in raw_screens.items()}
+        await self.screens.migrate()
 
-    def get_screen(self, server_id, *, create=False):
-        screen = self.screens.get(server_id)
-        if screen is None and create:
-            screen = BaseScreen()
-            self.screens[server_id] = screen
-        return screen
+    async def get_screen(self, server_id, *, create=False):
+        return await self.screens.get(server_id, create=create)
 
     async def _validate_index(self, ctx, screen, index):
         if screen is None or len(screen.elements) == 0:
@@ -351,24 +519,45 @@ class InfoScreen(commands.Cog):
             await ctx.send('The index should be between 1 and %d inclusive.' % len(screen.elements))
             return None
 
-    async def save_screens(self):
-        await self.config.screens.set({server_id: screen.elements for server_id, screen in self.screens.items()})
+    def warm_images(self, screen):
+        """Downloads the raw images of a screen into the image cache in the background."""
+        self.bot.loop.create_task(self.images.warm(screen.raw_image_urls()))
+
+    async def screen_changed(self, ctx, screen):
+        """Saves a changed screen and warns if it can no longer be sent."""
+        screen.invalidate()
+        self.screens.mark_dirty(ctx.guild.id, screen)
+        try:
+            screen.compile()
+        except ScreenError as e:
+            await ctx.send('Warning: the info screen can not be sent like this. %s' % e)
 
     @commands.command(no_pm=True)
     @checks.admin()
-    async def infosend(self, ctx):
-        """Sends the info screen in the current channel."""
-        screen = self.get_screen(ctx.guild.id)
+    async def infosend(self, ctx, new: bool = False):
+        """Sends the info screen in the current channel.
+
+        If it was sent in this channel before, only the entries that changed since are updated,
+        unless new is set.
+        """
+        screen = await self.get_screen(ctx.guild.id)
         if screen is None or screen.is_empty():
             await ctx.send('The info screen is empty.')
         else:
-            await screen.send(self.bot, ctx.message.channel)
+            published = self.config.channel(ctx.channel).published
+            try:
+                copy = await screen.send(self.bot, ctx.message.channel, self.images,
+                                         [] if new else await published(), ctx.message.id)
+            except (ImageError, ScreenError) as e:
+                await ctx.send(str(e))
+            else:
+                await published.set(copy)
 
     @commands.command(no_pm=True)
     @checks.admin()
     async def infolist(self, ctx):
         """Lists entries in the info screen."""
-        screen = self.get_screen(ctx.guild.id)
+        screen = await self.get_screen(ctx.guild.id)
         if screen is None or screen.is_empty():
             await ctx.send('The info screen is empty.')
         else:
@@ -382,7 +571,7 @@ class InfoScreen(commands.Cog):
     @checks.admin()
     async def infoadd(self, ctx, index=None):
         """Adds an entry."""
-        screen = self.get_screen(ctx.guild.id, create=True)
+        screen = await self.get_screen(ctx.guild.id, create=True)
         if index is not None:
             index = await self._validate_index(ctx, screen, index)
             if index is None:
@@ -410,34 +599,36 @@ class InfoScreen(commands.Cog):
             await ctx.send('The image entry has been created.')
         else:
             await ctx.send('Invalid type. Aborting.')
-        await self.save_screens()
+        await self.screen_changed(ctx, screen)
+        self.warm_images(screen)
 
     @commands.command(no_pm=True)
     @checks.admin()
     async def infoedit(self, ctx, index):
         """Edits an entry."""
-        screen = self.get_screen(ctx.guild.id)
+        screen = await self.get_screen(ctx.guild.id)
         index = await self._validate_index(ctx, screen, index)
         if index is not None:
             await screen.edit_entry(self.bot, ctx.channel, ctx.author, index)
-            await self.save_screens()
+            await self.screen_changed(ctx, screen)
+            self.warm_images(screen)
 
     @commands.command(no_pm=True)
     @checks.admin()
     async def inforemove(self, ctx, index):
         """Removes an entry."""
-        screen = self.get_screen(ctx.guild.id)
+        screen = await self.get_screen(ctx.guild.id)
         index = await self._validate_index(ctx, screen, index)
         if index is not None:
             del screen.elements[index]
             await ctx.send('The entry at index %d has been removed.' % (index + 1))
-            await self.save_screens()
+            await self.screen_changed(ctx, screen)
 
     @commands.command(no_pm=True)
     @checks.admin()
     async def infomove(self, ctx, index, new_index):
         """Moves an entry to a new index."""
-        screen = self.get_screen(ctx.guild.id)
+        screen = await self.get_screen(ctx.guild.id)
         index = await self._validate_index(ctx, screen, index)
         new_index = await self._validate_index(ctx, screen, new_index)
         if index is None or new_index is None:
@@ -447,13 +638,13 @@ class InfoScreen(commands.Cog):
         del screen.elements[index]
         screen.elements.insert(new_index, element)
         await ctx.send('The entry at index %d was moved to index %d' % (index + 1, new_index + 1))
-        await self.save_screens()
+        await self.screen_changed(ctx, screen)
 
     @commands.command(no_pm=True)
     @checks.admin()
     async def infoswap(self, ctx, first_index, second_index):
         """Swaps an entry with another."""
-        screen = self.get_screen(ctx.guild.id)
+        screen = await self.get_screen(ctx.guild.id)
         first_index = await self._validate_index(ctx, screen, first_index)
         second_index = await self._validate_index(ctx, screen, second_index)
         if first_index is None or second_index is None:
@@ -466,4 +657,4 @@ class InfoScreen(commands.Cog):
             'The entry at index %d has been swapped with the entry at index %d' % (
                 first_index + 1, second_index + 1)
         )
-        await self.save_screens()
+        await self.screen_changed(ctx, screen)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import discord
+
+#: The amount of seconds changes to screens are collected before they are written to Config.
+screen_flush_delay = 5
+
+#: Roughly how many bytes of screens are kept in memory. Screens of cold guilds are evicted past this.
+screen_cache_size = 16 * 1024 * 1024
+
+
+def screen_size(screen):
+    return len(json.dumps(screen.elements))
+
+
+class ScreenStore:
+    """Loads the screen of a guild from its guild in Config on first use and writes changed ones back.
+
+    Loaded screens are kept in an LRU bounded by `screen_cache_size`, so memory does not grow
+    with the number of guilds that ever made a screen. Changes only mark their guild as dirty,
+    and the screens of dirty guilds are written back in one batch after `screen_flush_delay`,
+    so a burst of edits costs a single write per guild. Dirty screens are never evicted.
+    """
+
+    def __init__(self, config, factory, delay=screen_flush_delay, max_size=screen_cache_size):
+        self.config = config
+        self.config.register_global(screens={})
+        self.config.register_guild(elements=[])
+        self.factory = factory
+        self.delay = delay
+        self.max_size = max_size
+        self.size = 0
+        # Loaded screens and their estimated size by guild ID, least recently used first.
+        self._screens = OrderedDict()
+        self._dirty = set()
+        self._flush_task = None
+
+    async def migrate(self):
+        """Moves the screens of the old global `screens` value to their guilds."""
+        screens = await self.config.screens()
+        if not screens:
+            return
+        for guild_id, elements in screens.items():
+            await self.config.guild(discord.Object(id=int(guild_id))).elements.set(elements)
+        await self.config.screens.clear()
+
+    async def get(self, guild_id, *, create=False):
+        entry = self._screens.get(guild_id)
+        if entry is not None:
+            self._screens.move_to_end(guild_id)
+            return entry[0]
+        elements = await self.config.guild(discord.Object(id=guild_id)).elements()
+        if not elements and not create:
+            return None
+        # Another caller may have loaded the screen while Config was read.
+        if guild_id not in self._screens:
+            self._put(guild_id, self.factory(elements))
+        return self._screens[guild_id][0]
+
+    def _put(self, guild_id, screen):
+        """Caches a screen as the most recently used one, evicting cold screens if the cache is full."""
+        old = self._screens.pop(guild_id, None)
+        if old is not None:
+            self.size -= old[1]
+        size = screen_size(screen)
+        self._screens[guild_id] = (screen, size)
+        self.size += size
+        for cold_id in list(self._screens)[:-1]:
+            if self.size <= self.max_size:
+                break
+            if cold_id not in self._dirty:
+                self.size -= self._screens.pop(cold_id)[1]
+
+    def mark_dirty(self, guild_id, screen):
+        """Marks a changed screen for writing. The screen is cached again if it was evicted meanwhile."""
+        entry = self._screens.get(guild_id)
+        if entry is None or entry[0] is not screen:
+            self._put(guild_id, screen)
+        self._screens.move_to_end(guild_id)
+        self._dirty.add(guild_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_event_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Writes the screens of all dirty guilds to Config."""
+        while self._dirty:
+            guild_id = self._dirty.pop()
+            guild_config = self.config.guild(discord.Object(id=guild_id))
+            screen = self._screens[guild_id][0]
+            if screen.is_empty():
+                await guild_config.elements.clear()
+            else:
+                await guild_config.elements.set(screen.elements)
+            entry = self._screens.get(guild_id)
+            if entry is not None and entry[0] is screen:
+                size = screen_size(screen)
+                self.size += size - entry[1]
+                self._screens[guild_id] = (screen, size)
+
+    def close(self):
+        """Cancels the pending delayed flush and writes out all changes right away."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        return asyncio.get_event_loop().create_task(self.flush())
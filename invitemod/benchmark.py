@@ -0,0 +1,289 @@
+"""Load test for the InviteMod message listener.
+
+Replays a synthetic message stream through `InviteMod.on_message` against in-process fakes
+of `fetch_invite`, Config and message deletion with injectable latency and 429s, and reports
+throughput, processing latency, REST calls and Config reads and writes per message. Run it with
+`python -m invitemod.benchmark` from the repository root.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+import discord
+
+from .invitemod import InviteMod
+from .logbuffer import LogBuffer
+from .raid import DeleteBatcher, RaidDetector
+from .resolver import InviteResolver
+from .settings import SettingsCache
+
+#: The guild invites of the whitelisted kind point to.
+WHITELISTED_GUILD = 1
+
+#: The guild the benchmark messages are posted in.
+HOME_GUILD = 2
+
+FAKE_CONTENTS = ['hello there', 'did anyone see the discord stream?', 'lol', 'ok ' * 40]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Stats:
+    def __init__(self):
+        self.calls = {}
+        self.rate_limited = 0
+        self.latencies = []
+
+
+class FakeApi:
+    """Simulates REST calls: latency, plus 429 retries like discord.py does internally."""
+
+    def __init__(self, stats, latency, rate_limit_chance, retry_after):
+        self.stats = stats
+        self.latency = latency
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+
+    async def request(self, route):
+        while random.random() < self.rate_limit_chance:
+            self.stats.rate_limited += 1
+            await asyncio.sleep(self.retry_after)
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        self.stats.calls[route] = self.stats.calls.get(route, 0) + 1
+
+
+class FakeResponse:
+    status = 404
+    reason = 'Not Found'
+
+
+class FakeInviteGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = 'Guild %d' % guild_id
+
+
+class FakeInvite:
+    def __init__(self, guild_id):
+        self.guild = FakeInviteGuild(guild_id)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeAuthor:
+    bot = False
+
+    def __init__(self, author_id):
+        self.id = author_id
+
+    def __str__(self):
+        return 'user#%04d' % (self.id % 10000)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, api):
+        self.id = channel_id
+        self.guild = guild
+        self.api = api
+
+    async def delete_messages(self, messages):
+        await self.api.request('bulk' if len(messages) > 1 else 'delete')
+
+    async def send(self, content=None, **kwargs):
+        await self.api.request('send')
+
+
+class FakeMessage:
+    __slots__ = ('id', 'content', 'author', 'guild', 'channel', 'created_at')
+
+    def __init__(self, message_id, content, author, channel):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.guild = channel.guild
+        self.channel = channel
+        self.created_at = datetime.utcnow()
+
+    async def delete(self):
+        await self.channel.api.request('delete')
+
+
+class FakeGroup:
+    """A Config value whose reads and writes go through the simulated Config backend."""
+
+    def __init__(self, api, value):
+        self.api = api
+        self.value = value
+
+    async def __call__(self):
+        await self.api.request('config')
+        return self.value
+
+    async def set(self, value):
+        await self.api.request('config')
+        self.value = value
+
+
+class FakeGuildConfig:
+    def __init__(self, api, whitelist, logging_channel):
+        self.api = api
+        self.whitelist = FakeGroup(api, whitelist)
+        self.logging_channel = FakeGroup(api, logging_channel)
+
+    async def all(self):
+        await self.api.request('config')
+        return {'whitelist': self.whitelist.value, 'logging_channel': self.logging_channel.value}
+
+
+class FakeConfig:
+    """Stands in for Config with one guild whitelisting `WHITELISTED_GUILD` and logging to a channel."""
+
+    def __init__(self, api, logging_channel_id):
+        self.api = api
+        self.guilds = {HOME_GUILD: FakeGuildConfig(api, [WHITELISTED_GUILD], logging_channel_id)}
+
+    def guild(self, guild):
+        return self.guilds[guild.id]
+
+
+class FakeStore:
+    def record(self, infraction):
+        pass
+
+    async def close(self):
+        pass
+
+
+class FakeBot:
+    def __init__(self, api, channels):
+        self.api = api
+        self.channels = {channel.id: channel for channel in channels}
+        self.guild = channels[0].guild
+        self.loop = asyncio.get_event_loop()
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    async def fetch_invite(self, code):
+        await self.api.request('invite')
+        kind, number = code.split('x')
+        if kind == 'gone':
+            raise discord.NotFound(FakeResponse(), 'Unknown Invite')
+        return FakeInvite(WHITELISTED_GUILD if kind == 'ok' else 1000 + int(number))
+
+
+def build_cog(api, config_api, channels, log_channel):
+    """Builds an InviteMod cog around the fakes, without the scanner and the infraction database."""
+    cog = InviteMod.__new__(InviteMod)
+    cog.bot = FakeBot(api, channels + [log_channel])
+    cog.config = FakeConfig(config_api, log_channel.id)
+    cog.resolver = InviteResolver(cog.bot.fetch_invite)
+    cog.settings = SettingsCache(cog.config)
+    cog.raids = RaidDetector()
+    cog.batcher = DeleteBatcher()
+    cog.logs = LogBuffer(cog._send_log)
+    cog.store = FakeStore()
+    return cog
+
+
+def build_stream(args, channels):
+    """Builds the message stream, mixing plain text, whitelisted, bad and invalid invites."""
+    kinds = ['plain', 'ok', 'bad', 'gone']
+    weights = [1 - args.whitelisted - args.bad - args.invalid, args.whitelisted, args.bad, args.invalid]
+    messages = []
+    for message_id in range(args.messages):
+        kind = random.choices(kinds, weights)[0]
+        if kind == 'plain':
+            content = random.choice(FAKE_CONTENTS)
+        else:
+            content = 'join https://discord.gg/%sx%d now' % (kind, random.randrange(args.distinct_codes))
+        messages.append(FakeMessage(message_id, content, FakeAuthor(random.randrange(1000)),
+                                    random.choice(channels)))
+    return messages
+
+
+async def bench_listener(args, name, rate):
+    """Dispatches the stream at `rate` messages per second, or all at once if it is 0."""
+    stats = Stats()
+    api = FakeApi(stats, args.latency, args.rate_limit_chance, args.retry_after)
+    # Config is not rate limited, but a cold settings cache waits on its backend.
+    config_api = FakeApi(stats, args.config_latency, 0, 0)
+    guild = FakeGuild(HOME_GUILD)
+    channels = [FakeChannel(channel_id, guild, api) for channel_id in range(10, 10 + args.channels)]
+    cog = build_cog(api, config_api, channels, FakeChannel(1, guild, api))
+    messages = build_stream(args, channels)
+
+    async def process(message):
+        start = time.perf_counter()
+        await cog.on_message(message)
+        stats.latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tasks = []
+    for index, message in enumerate(messages):
+        if rate:
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # discord.py runs every listener call in its own task.
+        tasks.append(asyncio.ensure_future(process(message)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await cog.batcher.flush()
+    await cog.logs.flush_all()
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+    config_calls = stats.calls.pop('config', 0)
+    calls = sum(stats.calls.values())
+    print("%s: %d messages in %.2fs, %.0f messages/sec, %d rate limited" % (
+        name, len(messages), elapsed, len(messages) / elapsed if elapsed else 0.0, stats.rate_limited))
+    print("    processing latency p50 %.1fms, p99 %.1fms, max %.1fms" % (
+        percentile(stats.latencies, 50) * 1000, percentile(stats.latencies, 99) * 1000,
+        max(stats.latencies, default=0.0) * 1000))
+    print("    %.3f REST calls per message (%s)" % (
+        calls / len(messages), ', '.join("%s %d" % item for item in sorted(stats.calls.items()))))
+    print("    %d Config reads and writes, %.4f per message" % (config_calls, config_calls / len(messages)))
+    print("    %s" % cog.resolver.describe())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--rate', type=float, default=2000, help='messages per second of the steady stream')
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--whitelisted', type=float, default=0.02, help='share of messages with whitelisted invites')
+    parser.add_argument('--bad', type=float, default=0.03, help='share of messages with invites to other servers')
+    parser.add_argument('--invalid', type=float, default=0.01, help='share of messages with invalid invites')
+    parser.add_argument('--distinct-codes', type=int, default=50, help='distinct codes per kind of invite')
+    parser.add_argument('--latency', type=float, default=0.1, help='average latency of a REST call in seconds')
+    parser.add_argument('--config-latency', type=float, default=0.01,
+                        help='average latency of a Config read or write in seconds')
+    parser.add_argument('--rate-limit-chance', type=float, default=0.02, help='chance of a REST call getting a 429')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='seconds to wait after a 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    random.seed(args.seed)
+    loop.run_until_complete(bench_listener(args, 'steady stream', args.rate))
+    random.seed(args.seed)
+    loop.run_until_complete(bench_listener(args, 'flood', 0))
+
+
+if __name__ == '__main__':
+    main()
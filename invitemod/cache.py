@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+#: The most invite codes kept in the cache. Each entry costs roughly 300 bytes.
+cache_size = 10000
+
+#: The amount of seconds a resolved invite is trusted.
+cache_ttl = 15 * 60
+
+#: The amount of seconds an invalid or guild-less invite is remembered.
+negative_ttl = 5 * 60
+
+MISSING = object()
+
+
+class InviteTarget(NamedTuple):
+    """The guild an invite code points to."""
+    guild_id: int
+    guild_name: str
+
+
+class InviteCache:
+    """A bounded LRU cache of invite code -> `InviteTarget` with a TTL.
+
+    Invalid and guild-less invites are cached as None with their own, usually shorter, TTL.
+    When the cache is full the least recently used code is evicted.
+    """
+
+    def __init__(self, max_size: int = cache_size, ttl: float = cache_ttl, negative: float = negative_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, code: str):
+        """Returns the cached target of a code, which may be None, or `MISSING` if it is not cached."""
+        entry = self._entries.get(code)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        expires, target = entry
+        if expires < time.monotonic():
+            del self._entries[code]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(code)
+        self.hits += 1
+        return target
+
+    def set(self, code: str, target: Optional[InviteTarget]):
+        ttl = self.ttl if target is not None else self.negative_ttl
+        self._entries[code] = (time.monotonic() + ttl, target)
+        self._entries.move_to_end(code)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def describe(self):
+        lookups = self.hits + self.misses
+        return "%d/%d codes cached, %d hits, %d misses (%.1f%% hit rate), %d evictions, %d expirations." % (
+            len(self._entries), self.max_size, self.hits, self.misses,
+            100 * self.hits / lookups if lookups else 0.0, self.evictions, self.expirations
+        )
@@ -1,16 +1,45 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Union
+
 import discord
-from discord import Message, NotFound
-from discord.invite import Invite
+from discord import Message
 from redbot.core import commands, Config, checks
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils import chat_formatting, common_filters
 
+from .cache import InviteTarget
+from .logbuffer import LogBuffer
+from .raid import DeleteBatcher, RaidDetector
+from .resolver import InviteResolver
+from .scan import InviteScanner
+from .settings import SettingsCache
+from .store import Infraction, InfractionStore
+
+
+#: A fragment every invite link matched by `INVITE_URL_RE` contains. Messages without it skip the regex.
+INVITE_HINT = 'discord'
+
 
 def get_invites(msg):
     """Finds all invites in a message."""
+    if INVITE_HINT not in msg.lower():
+        return []
     return common_filters.INVITE_URL_RE.findall(msg)
 
 
+def timestamp(time: datetime) -> str:
+    """Formats the time a log line refers to. Log lines are sent with a delay, so each one carries its own."""
+    return chat_formatting.inline(time.strftime("%H:%M:%S"))
+
+
+def get_invite_codes(msg) -> List[str]:
+    """Finds the distinct invite codes in a message, in order of appearance."""
+    return list(dict.fromkeys(code for _, code in get_invites(msg)))
+
+
 class InviteMod(commands.Cog):
     """Moderates invite links"""
 
@@ -24,12 +53,29 @@ class InviteMod(commands.Cog):
             'logging_channel': 0,
         }
         self.config.register_guild(**default_guild)
+        self.resolver = InviteResolver(self.bot.fetch_invite)
+        self.settings = SettingsCache(self.config)
+        self.raids = RaidDetector()
+        self.batcher = DeleteBatcher()
+        self.logs = LogBuffer(self._send_log)
+        self.store = InfractionStore(cog_data_path(self) / 'infractions.db')
+        self.scanner = InviteScanner(self.config, get_invite_codes, self.resolve_invite, self._remove_if_offending)
+
+    def cog_unload(self):
+        self.scanner.cancel_all()
+        self.bot.loop.create_task(self._shutdown())
+
+    async def _shutdown(self):
+        """Deletes the messages queued in raid mode and sends the pending log lines."""
+        await self.batcher.flush()
+        await self.logs.flush_all()
+        await self.store.close()
 
     @commands.command()
     @checks.admin()
     async def invite_whitelist(self, ctx: commands.context.Context):
         """Shows which guilds are whitelisted."""
-        whitelist = await self.config.guild(ctx.guild).whitelist()
+        whitelist = sorted((await self.settings.get(ctx.guild)).whitelist)
         if len(whitelist) > 0:
             formatted_whitelist = '\n'.join(
                 "%d. %s" % (index + 1, guild_id) for index, guild_id in enumerate(whitelist))
@@ -41,10 +87,7 @@ class InviteMod(commands.Cog):
     @checks.admin()
     async def invite_whitelist_add(self, ctx: commands.context.Context, guild_id: int):
         """Adds a guild ID to the invite whitelist."""
-        whitelist = await self.config.guild(ctx.guild).whitelist()
-        if guild_id not in whitelist:
-            whitelist.append(guild_id)
-            await self.config.guild(ctx.guild).whitelist.set(whitelist)
+        if await self.settings.add_whitelist(ctx.guild, guild_id):
             await ctx.send("Added %s to the whitelist." % guild_id)
         else:
             await ctx.send("%s is already whitelisted." % guild_id)
@@ -53,10 +96,7 @@ class InviteMod(commands.Cog):
     @checks.admin()
     async def invite_whitelist_remove(self, ctx: commands.context.Context, guild_id: int):
         """Removes a guild ID from the invite whitelist."""
-        whitelist = await self.config.guild(ctx.guild).whitelist()
-        if guild_id in whitelist:
-            whitelist.remove(guild_id)
-            await self.config.guild(ctx.guild).whitelist.set(whitelist)
+        if await self.settings.remove_whitelist(ctx.guild, guild_id):
             await ctx.send("Removed %s from the whitelist." % guild_id)
         else:
             await ctx.send("%s is not on the whitelist." % guild_id)
@@ -66,55 +106,192 @@ class InviteMod(commands.Cog):
     async def invite_whitelist_logging(self, ctx: commands.context.Context, channel: discord.TextChannel = None):
         """Sets the logging channel for invite infractions."""
         if channel:
-            await self.config.guild(ctx.guild).logging_channel.set(channel.id)
+            await self.settings.set_logging_channel(ctx.guild, channel.id)
             await ctx.send("Set logging channel to %s." % channel.mention)
         else:
-            await self.config.guild(ctx.guild).logging_channel.set(0)
+            await self.settings.set_logging_channel(ctx.guild, 0)
             await ctx.send("Cleared logging channel.")
 
-    async def handle_invite(self, message: discord.Message, code):
-        """Handles an invite code on a given message."""
+    @commands.command()
+    @checks.is_owner()
+    async def invite_cache(self, ctx: commands.context.Context, clear: bool = False):
+        """Shows the invite cache statistics, optionally clearing the cache."""
+        await ctx.send("Invite cache: %s" % self.resolver.describe())
+        if clear:
+            self.resolver.cache.clear()
+            await ctx.send("Cleared the invite cache.")
+
+    @commands.command()
+    @checks.mod()
+    async def invite_history(self, ctx: commands.context.Context, user: Union[discord.Member, int]):
+        """Shows the latest invite infractions of a user."""
+        user_id = user if isinstance(user, int) else user.id
+        total, infractions = await self.store.history(ctx.guild.id, user_id)
+        if not infractions:
+            await ctx.send("%s has no invite infractions." % user_id)
+            return
+        lines = ["%s in <#%d>: %s to %s (%s)" % (
+            chat_formatting.inline(datetime.utcfromtimestamp(infraction.created_at).strftime("%Y-%m-%d %H:%M")),
+            infraction.channel_id,
+            chat_formatting.inline("https://discord.gg/%s" % infraction.code),
+            infraction.target_name,
+            chat_formatting.inline(str(infraction.target_id))
+        ) for infraction in infractions]
+        header = "%s has %d invite infractions, the latest %d are:" % (
+            chat_formatting.inline(str(user_id)), total, len(infractions))
+        for page in chat_formatting.pagify("\n".join([header] + lines)):
+            await ctx.send(page)
+
+    @commands.command()
+    @checks.mod()
+    async def invite_top(self, ctx: commands.context.Context, days: int = 30):
+        """Shows the servers that were advertised the most in the last days."""
+        targets = await self.store.top_targets(ctx.guild.id, time.time() - days * 86400)
+        if targets:
+            formatted = '\n'.join("%d. %s (%d): %d" % (index + 1, name, target_id, count)
+                                  for index, (target_id, name, count) in enumerate(targets))
+        else:
+            formatted = 'None'
+        await ctx.send("Most advertised servers in the last %d days:" % days + chat_formatting.box(formatted))
+
+    @commands.command()
+    @checks.mod()
+    async def invite_stats(self, ctx: commands.context.Context, days: int = 14):
+        """Shows the amount of invite infractions per day."""
+        epoch = datetime(1970, 1, 1)
+        start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        counts = dict(await self.store.counts(ctx.guild.id, (start - epoch).total_seconds(), 86400))
+        formatted = []
+        for day in range(days):
+            date = start + timedelta(days=day)
+            formatted.append("%s %5d" % (date.strftime("%Y-%m-%d"), counts.get((date - epoch).total_seconds(), 0)))
+        formatted = '\n'.join(formatted)
+        await ctx.send("Invite infractions per day:" + chat_formatting.box(formatted))
+
+    @commands.command()
+    @checks.admin()
+    async def invite_scan(self, ctx: commands.context.Context, channel: Optional[discord.TextChannel] = None,
+                          restart: bool = False):
+        """Checks the invites in the history of a channel, or of every channel in this server.
+
+        A scan continues where the last scan of a channel stopped, unless restart is set.
+        """
+        if ctx.guild.id in self.scanner.scans:
+            await ctx.send("A scan is already running in this server.")
+            return
+        if channel:
+            channels = [channel]
+        else:
+            channels = [c for c in ctx.guild.text_channels if c.permissions_for(ctx.guild.me).read_message_history]
+        status = await ctx.send("Scanning %d channels..." % len(channels))
+        self.scanner.start(ctx.guild, channels, status, restart)
+
+    @commands.command()
+    @checks.admin()
+    async def invite_scan_cancel(self, ctx: commands.context.Context):
+        """Cancels the running scan in this server. It can be continued later with invite_scan."""
+        if self.scanner.cancel(ctx.guild.id):
+            await ctx.send("Cancelled the scan.")
+        else:
+            await ctx.send("No scan is running in this server.")
+
+    async def resolve_invite(self, code) -> Optional[InviteTarget]:
+        """Resolves the guild an invite code points to, or None if the invite is invalid or has no guild."""
+        return await self.resolver.resolve(code)
+
+    async def handle_invites(self, message: discord.Message, codes: List[str]):
+        """Handles invite codes on a given message, resolving them concurrently.
+
+        Stops at the first invite that gets the message removed and cancels the remaining lookups.
+        """
+        if len(codes) == 1:
+            target = await self.resolve_invite(codes[0])
+            return await self._remove_if_offending(message, codes[0], target)
+
+        lookups = {asyncio.ensure_future(self.resolve_invite(code)): code for code in codes}
+        pending = set(lookups)
         try:
-            invite: Invite = await self.bot.fetch_invite(code)
-        except NotFound:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for lookup in done:
+                    if await self._remove_if_offending(message, lookups[lookup], lookup.result()):
+                        return True
             return False
+        finally:
+            for lookup in pending:
+                lookup.cancel()
+
+    async def _remove_if_offending(self, message: discord.Message, code, target: Optional[InviteTarget],
+                                   batcher: DeleteBatcher = None):
+        """Removes a message if the invite it contains points to a guild that is not whitelisted.
 
-        if not invite.guild:
+        If a batcher is given the message is queued in it instead of being deleted right away.
+        """
+        if target is None:
             return False
 
-        whitelist = await self.config.guild(message.guild).whitelist()
-        if invite.guild.id not in whitelist:
-            await message.delete()
+        settings = await self.settings.get(message.guild)
+        if target.guild_id not in settings.whitelist:
+            if batcher is not None:
+                batcher.put(message)
+            else:
+                await self._remove(message)
+            self.store.record(Infraction(
+                message.guild.id, message.channel.id, message.author.id, message.id, code, target.guild_id,
+                target.guild_name, (message.created_at - datetime(1970, 1, 1)).total_seconds()))
             log = "[%s] :space_invader: %s (%s) posted an invite link to a server (%s, %s) that is not whitelisted " \
                   "and their message was removed." % (
-                      chat_formatting.inline(message.created_at.strftime("%H:%M:%S")),
+                      timestamp(message.created_at),
                       message.author,
                       chat_formatting.inline(str(message.author.id)),
-                      invite.guild.name,
-                      chat_formatting.inline(str(invite))
+                      target.guild_name,
+                      chat_formatting.inline("https://discord.gg/%s" % code)
                   )
             await self.log(message.guild, log)
             return True
         return False
 
+    async def _remove(self, message: discord.Message):
+        """Deletes an offending message, or queues it for a bulk delete while the guild is in raid mode."""
+        if self.raids.record(message.guild.id):
+            await self.log(message.guild, "[%s] :rotating_light: Raid mode is on. Offending messages are now "
+                                          "removed in bulk." % timestamp(message.created_at))
+            self.bot.loop.create_task(self._watch_raid(message.guild))
+        if self.raids.is_active(message.guild.id):
+            self.batcher.put(message)
+        else:
+            await message.delete()
+
+    async def _watch_raid(self, guild: discord.Guild):
+        """Announces when raid mode turns off again."""
+        while self.raids.is_active(guild.id):
+            await asyncio.sleep(self.raids.window / 3)
+        await self.log(guild, "[%s] :white_check_mark: Raid mode is off." % timestamp(datetime.utcnow()))
+
     @commands.Cog.listener()
     async def on_message(self, message: Message):
         """Processes invites in incoming messages."""
-        if message.author.bot:
+        if message.author.bot or message.guild is None:
             return
-        for _, code in get_invites(message.content):
-            did_delete = await self.handle_invite(message, code)
-            if did_delete:
-                break
+        codes = get_invite_codes(message.content)
+        if codes:
+            await self.handle_invites(message, codes)
 
     async def log(self, guild: discord.Guild, log: str):
-        """Logs to the logging channel if possible."""
-        channel_id = await self.config.guild(guild).logging_channel()
-        if not channel_id:
+        """Logs to the logging channel if possible.
+
+        Lines are buffered per guild and sent together, see `LogBuffer`.
+        """
+        if (await self.settings.get(guild)).logging_channel:
+            self.logs.put(guild.id, log)
+
+    async def _send_log(self, guild_id: int, text: str):
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
             return
 
-        channel = self.bot.get_channel(channel_id)
+        channel = self.bot.get_channel((await self.settings.get(guild)).logging_channel)
         if not channel:
             return
 
-        await channel.send(log)
+        await channel.send(text)
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+import discord
+from redbot.core.utils.chat_formatting import pagify
+
+#: The amount of seconds log lines are collected before they are sent together.
+log_flush_interval = 5
+
+#: The amount of pending log lines of a guild that triggers an immediate flush.
+log_max_lines = 20
+
+
+class LogBuffer:
+    """Collects log lines per guild and sends them as few messages as possible.
+
+    A guild's lines are sent `log_flush_interval` seconds after the first one arrived, or as
+    soon as `log_max_lines` are pending, split into pages that fit the message length limit.
+    Lines are sent in the order they were logged.
+    """
+
+    def __init__(self, send: Callable[[int, str], Awaitable], interval: float = log_flush_interval,
+                 max_lines: int = log_max_lines):
+        self.send = send
+        self.interval = interval
+        self.max_lines = max_lines
+        self.lines = 0
+        self.messages = 0
+        self._pending: Dict[int, List[str]] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def __len__(self):
+        return sum(len(lines) for lines in self._pending.values())
+
+    def put(self, guild_id: int, line: str):
+        lines = self._pending.setdefault(guild_id, [])
+        lines.append(line)
+        self.lines += 1
+        if len(lines) >= self.max_lines:
+            timer = self._timers.pop(guild_id, None)
+            if timer is not None:
+                timer.cancel()
+            asyncio.get_event_loop().create_task(self.flush(guild_id))
+        elif guild_id not in self._timers:
+            self._timers[guild_id] = asyncio.get_event_loop().create_task(self._flush_later(guild_id))
+
+    async def _flush_later(self, guild_id: int):
+        await asyncio.sleep(self.interval)
+        del self._timers[guild_id]
+        await self.flush(guild_id)
+
+    async def flush(self, guild_id: int):
+        """Sends the pending lines of a guild right away."""
+        # Locked so that a flush started while an earlier one is still sending cannot overtake it.
+        async with self._locks.setdefault(guild_id, asyncio.Lock()):
+            lines = self._pending.pop(guild_id, None)
+            if not lines:
+                return
+            for page in pagify("\n".join(lines)):
+                self.messages += 1
+                try:
+                    await self.send(guild_id, page)
+                except discord.HTTPException as e:
+                    print("Failed to send %d log lines for guild %s: %s" % (len(lines), guild_id, e))
+                    return
+
+    async def flush_all(self):
+        """Sends the pending lines of every guild right away."""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for guild_id in list(self._pending):
+            await self.flush(guild_id)
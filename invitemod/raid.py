@@ -0,0 +1,111 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List
+
+import discord
+
+#: The amount of offending invites within `raid_window` seconds that turns raid mode on.
+raid_threshold = 10
+
+#: Raid mode turns off again when fewer offending invites than this were seen within `raid_window` seconds.
+raid_exit_threshold = 3
+
+#: The length of the sliding window raid mode looks at, in seconds.
+raid_window = 30
+
+#: The amount of seconds offending messages are collected before they are bulk deleted.
+raid_flush_interval = 1
+
+#: Discord only allows bulk deleting messages younger than this.
+bulk_window = timedelta(days=14, minutes=-10)
+
+
+class RaidDetector:
+    """Turns raid mode on for a guild when offending invites exceed a rate, and off when it drops."""
+
+    def __init__(self, threshold: int = raid_threshold, exit_threshold: int = raid_exit_threshold,
+                 window: float = raid_window):
+        self.threshold = threshold
+        self.exit_threshold = exit_threshold
+        self.window = window
+        self._events: Dict[int, Deque[float]] = {}
+        self._active = set()
+
+    def _count(self, guild_id: int, now: float) -> int:
+        events = self._events.get(guild_id)
+        if events is None:
+            return 0
+        while events and events[0] < now - self.window:
+            events.popleft()
+        if not events:
+            del self._events[guild_id]
+            return 0
+        return len(events)
+
+    def record(self, guild_id: int) -> bool:
+        """Records an offending invite. Returns True if this turned raid mode on."""
+        now = time.monotonic()
+        self._events.setdefault(guild_id, deque()).append(now)
+        if guild_id not in self._active and self._count(guild_id, now) >= self.threshold:
+            self._active.add(guild_id)
+            return True
+        return False
+
+    def is_active(self, guild_id: int) -> bool:
+        """Tells whether a guild is in raid mode, turning it off if the rate has dropped."""
+        if guild_id in self._active and self._count(guild_id, time.monotonic()) < self.exit_threshold:
+            self._active.discard(guild_id)
+        return guild_id in self._active
+
+
+class DeleteBatcher:
+    """Collects messages per channel and removes them with bulk deletes of up to 100 messages.
+
+    Messages too old for bulk deletion are deleted one by one.
+    """
+
+    def __init__(self, interval: float = raid_flush_interval):
+        self.interval = interval
+        self.deleted = 0
+        self.requests = 0
+        self._queues: Dict[int, List[discord.Message]] = {}
+        self._channels: Dict[int, discord.TextChannel] = {}
+        self._task = None
+
+    def __len__(self):
+        return sum(len(messages) for messages in self._queues.values())
+
+    def put(self, message: discord.Message):
+        self._channels[message.channel.id] = message.channel
+        self._queues.setdefault(message.channel.id, []).append(message)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        """Deletes all queued messages right away."""
+        while self._queues:
+            channel_id, messages = self._queues.popitem()
+            channel = self._channels.pop(channel_id)
+            cutoff = datetime.utcnow() - bulk_window
+            young = [m for m in messages if m.created_at > cutoff]
+            for index in range(0, len(young), 100):
+                await self._delete(channel, young[index:index + 100])
+            for message in messages:
+                if message.created_at <= cutoff:
+                    await self._delete(channel, [message])
+
+    async def _delete(self, channel: discord.TextChannel, messages: List[discord.Message]):
+        self.requests += 1
+        try:
+            await channel.delete_messages(messages)
+            self.deleted += len(messages)
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            print("Failed to delete %d messages in %s: %s" % (len(messages), channel.id, e))
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from discord import NotFound
+from discord.invite import Invite
+
+from .cache import MISSING, InviteCache, InviteTarget
+
+#: The most invite lookups that may be waiting on the API at the same time.
+max_concurrent_lookups = 4
+
+
+class InviteResolver:
+    """Resolves invite codes through the cache, sharing a single lookup between concurrent callers.
+
+    At most `max_concurrent_lookups` lookups run at once, so an invite flood cannot use up the
+    bot's whole REST budget.
+    """
+
+    def __init__(self, fetch_invite: Callable[[str], Awaitable[Invite]], cache: InviteCache = None,
+                 max_lookups: int = max_concurrent_lookups):
+        self.fetch_invite = fetch_invite
+        self.cache = cache if cache is not None else InviteCache()
+        self.lookups = 0
+        self.coalesced = 0
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(max_lookups)
+
+    async def resolve(self, code: str) -> Optional[InviteTarget]:
+        """Resolves the guild an invite code points to, or None if the invite is invalid or has no guild."""
+        target = self.cache.get(code)
+        if target is not MISSING:
+            return target
+
+        task = self._inflight.get(code)
+        if task is None:
+            task = asyncio.get_event_loop().create_task(self._lookup(code))
+            self._inflight[code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(code, None))
+        else:
+            self.coalesced += 1
+        # Shielded so that one cancelled caller does not cancel the lookup the others wait on.
+        return await asyncio.shield(task)
+
+    async def _lookup(self, code: str) -> Optional[InviteTarget]:
+        async with self._semaphore:
+            self.lookups += 1
+            try:
+                invite = await self.fetch_invite(code)
+            except NotFound:
+                target = None
+            else:
+                target = InviteTarget(invite.guild.id, invite.guild.name) if invite.guild else None
+        self.cache.set(code, target)
+        return target
+
+    def describe(self):
+        return "%s %d lookups, %d coalesced, %d in flight." % (
+            self.cache.describe(), self.lookups, self.coalesced, len(self._inflight))
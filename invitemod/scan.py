@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+from .cache import MISSING, InviteTarget
+from .raid import DeleteBatcher
+
+#: The most messages with invites that may wait for their invites to be checked during a scan.
+scan_queue_size = 100
+
+#: The amount of messages whose invites are checked at the same time during a scan.
+scan_workers = 4
+
+#: The amount of seconds between progress updates and checkpoints of a scan.
+scan_progress_interval = 5
+
+
+class ScanRun:
+    """The progress of a single scan."""
+
+    def __init__(self, channels: List[discord.TextChannel]):
+        self.channels = channels
+        self.channels_done = 0
+        self.scanned = 0
+        self.invites = 0
+        self.removed = 0
+        self.targets: Dict[str, Optional[InviteTarget]] = {}
+
+    def describe(self):
+        return "%d/%d channels, %d messages scanned, %d invites checked (%d distinct), %d messages removed." % (
+            self.channels_done, len(self.channels), self.scanned, self.invites, len(self.targets), self.removed)
+
+
+class InviteScanner:
+    """Checks the invites in the history of channels, oldest message first.
+
+    History is streamed page by page into a bounded queue that a few workers drain, so memory
+    stays flat however long a channel is. Each code is resolved once per scan, and offending
+    messages are removed with bulk deletes. A channel's mark remembers the newest message up
+    to which everything was checked, so an interrupted scan continues where it stopped.
+    """
+
+    def __init__(self, config, get_codes: Callable[[str], List[str]],
+                 resolve: Callable[[str], Awaitable[Optional[InviteTarget]]],
+                 check: Callable[[discord.Message, str, Optional[InviteTarget], DeleteBatcher], Awaitable[bool]]):
+        self.config = config
+        self.config.register_channel(scan_mark=0)
+        self.get_codes = get_codes
+        self.resolve = resolve
+        self.check = check
+        self.scans: Dict[int, asyncio.Task] = {}
+
+    def start(self, guild: discord.Guild, channels: List[discord.TextChannel], status: discord.Message,
+              restart: bool = False) -> ScanRun:
+        run = ScanRun(channels)
+        task = asyncio.get_event_loop().create_task(self._run(run, status, restart))
+        self.scans[guild.id] = task
+        task.add_done_callback(lambda _: self.scans.pop(guild.id, None))
+        return run
+
+    def cancel(self, guild_id: int) -> bool:
+        task = self.scans.get(guild_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def cancel_all(self):
+        for task in self.scans.values():
+            task.cancel()
+
+    async def _run(self, run: ScanRun, status: discord.Message, restart: bool):
+        result = "Scan finished"
+        try:
+            for channel in run.channels:
+                await self._scan_channel(channel, run, status, restart)
+                run.channels_done += 1
+        except asyncio.CancelledError:
+            result = "Scan cancelled"
+            raise
+        finally:
+            try:
+                await status.edit(content="%s: %s" % (result, run.describe()))
+            except discord.HTTPException:
+                pass
+
+    async def _scan_channel(self, channel: discord.TextChannel, run: ScanRun, status: discord.Message,
+                            restart: bool):
+        mark = 0 if restart else await self.config.channel(channel).scan_mark()
+        last = mark
+        queue = asyncio.Queue(maxsize=scan_queue_size)
+        batcher = DeleteBatcher()
+        # IDs of queued messages in history order, and the ones of them that were handled already.
+        inflight = deque()
+        done = set()
+
+        def safe_mark():
+            while inflight and inflight[0] in done:
+                done.discard(inflight.popleft())
+            return inflight[0] - 1 if inflight else last
+
+        workers = [asyncio.get_event_loop().create_task(self._work(queue, batcher, run, done))
+                   for _ in range(scan_workers)]
+        next_report = time.monotonic() + scan_progress_interval
+        try:
+            async for message in channel.history(limit=None, after=discord.Object(id=mark), oldest_first=True):
+                run.scanned += 1
+                last = message.id
+                if not message.author.bot:
+                    codes = self.get_codes(message.content)
+                    if codes:
+                        inflight.append(message.id)
+                        await queue.put((message, codes))
+                if time.monotonic() >= next_report:
+                    next_report = time.monotonic() + scan_progress_interval
+                    await self._checkpoint(channel, batcher, safe_mark())
+                    try:
+                        await status.edit(content="Scanning %s: %s" % (channel.mention, run.describe()))
+                    except discord.HTTPException:
+                        pass
+            await queue.join()
+        except discord.Forbidden:
+            print("Cannot read the history of %s." % channel.id)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await self._checkpoint(channel, batcher, safe_mark())
+
+    async def _checkpoint(self, channel: discord.TextChannel, batcher: DeleteBatcher, mark: int):
+        # Offending messages are deleted before the mark moves past them.
+        await batcher.flush()
+        await self.config.channel(channel).scan_mark.set(mark)
+
+    async def _work(self, queue: asyncio.Queue, batcher: DeleteBatcher, run: ScanRun, done: set):
+        while True:
+            message, codes = await queue.get()
+            try:
+                for code in codes:
+                    run.invites += 1
+                    target = run.targets.get(code, MISSING)
+                    if target is MISSING:
+                        target = run.targets[code] = await self.resolve(code)
+                    if await self.check(message, code, target, batcher):
+                        run.removed += 1
+                        break
+            except discord.HTTPException as e:
+                print("Failed to check the invites of message %s: %s" % (message.id, e))
+            finally:
+                done.add(message.id)
+                queue.task_done()
@@ -0,0 +1,56 @@
+from typing import Dict, Set
+
+import discord
+from redbot.core import Config
+
+
+class GuildSettings:
+    """The whitelist and logging channel of a guild, kept in memory."""
+
+    __slots__ = ('whitelist', 'logging_channel')
+
+    def __init__(self, whitelist: Set[int], logging_channel: int):
+        self.whitelist = whitelist
+        self.logging_channel = logging_channel
+
+
+class SettingsCache:
+    """Loads the settings of a guild from Config on first use and writes changes through.
+
+    This keeps Config reads out of the per-message path.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._guilds: Dict[int, GuildSettings] = {}
+
+    async def get(self, guild: discord.Guild) -> GuildSettings:
+        settings = self._guilds.get(guild.id)
+        if settings is None:
+            data = await self.config.guild(guild).all()
+            settings = GuildSettings(set(data['whitelist']), data['logging_channel'])
+            self._guilds[guild.id] = settings
+        return settings
+
+    async def add_whitelist(self, guild: discord.Guild, guild_id: int) -> bool:
+        """Adds a guild ID to the whitelist. Returns False if it was already whitelisted."""
+        settings = await self.get(guild)
+        if guild_id in settings.whitelist:
+            return False
+        settings.whitelist.add(guild_id)
+        await self.config.guild(guild).whitelist.set(sorted(settings.whitelist))
+        return True
+
+    async def remove_whitelist(self, guild: discord.Guild, guild_id: int) -> bool:
+        """Removes a guild ID from the whitelist. Returns False if it was not whitelisted."""
+        settings = await self.get(guild)
+        if guild_id not in settings.whitelist:
+            return False
+        settings.whitelist.remove(guild_id)
+        await self.config.guild(guild).whitelist.set(sorted(settings.whitelist))
+        return True
+
+    async def set_logging_channel(self, guild: discord.Guild, channel_id: int):
+        settings = await self.get(guild)
+        settings.logging_channel = channel_id
+        await self.config.guild(guild).logging_channel.set(channel_id)
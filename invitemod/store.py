@@ -0,0 +1,126 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+#: The amount of seconds new infractions are collected before they are written together.
+store_flush_interval = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infractions (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    target_name TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS infractions_user ON infractions (guild_id, user_id, created_at);
+CREATE INDEX IF NOT EXISTS infractions_target ON infractions (guild_id, target_id, created_at);
+CREATE INDEX IF NOT EXISTS infractions_time ON infractions (guild_id, created_at);
+"""
+
+
+class Infraction(NamedTuple):
+    """An offending invite that got a message removed. `created_at` is a unix timestamp."""
+    guild_id: int
+    channel_id: int
+    user_id: int
+    message_id: int
+    code: str
+    target_id: int
+    target_name: str
+    created_at: float
+
+
+class InfractionStore:
+    """Keeps every infraction in an indexed SQLite database.
+
+    SQLite is only used from one worker thread, so the event loop never waits on the disk.
+    New infractions are written in batches every `store_flush_interval` seconds; queries
+    write the pending ones first so they always see everything recorded so far.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._connection = None
+        self._pending: List[Infraction] = []
+        self._task = None
+
+    def _run(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(str(self.path))
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        return self._connect().execute(sql, params).fetchall()
+
+    def _insert(self, infractions: List[Infraction]):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO infractions (guild_id, channel_id, user_id, message_id, code, target_id, target_name, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", infractions)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record(self, infraction: Infraction):
+        self._pending.append(infraction)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(store_flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Writes the pending infractions right away."""
+        if self._pending:
+            infractions, self._pending = self._pending, []
+            await self._run(self._insert, infractions)
+
+    async def close(self):
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    async def history(self, guild_id: int, user_id: int, limit: int = 20) -> Tuple[int, List[Infraction]]:
+        """Returns the total amount of infractions of a user and their latest ones, newest first."""
+        await self.flush()
+        total = (await self._run(self._query, "SELECT COUNT(*) FROM infractions WHERE guild_id = ? AND user_id = ?",
+                                 (guild_id, user_id)))[0][0]
+        rows = await self._run(self._query,
+                               "SELECT guild_id, channel_id, user_id, message_id, code, target_id, target_name, "
+                               "created_at FROM infractions WHERE guild_id = ? AND user_id = ? "
+                               "ORDER BY created_at DESC LIMIT ?", (guild_id, user_id, limit))
+        return total, [Infraction(*row) for row in rows]
+
+    async def top_targets(self, guild_id: int, since: float, limit: int = 10) -> List[Tuple[int, str, int]]:
+        """Returns the target guilds with the most infractions since a unix timestamp as (id, name, count)."""
+        await self.flush()
+        return await self._run(self._query,
+                               "SELECT target_id, MAX(target_name), COUNT(*) AS total FROM infractions "
+                               "WHERE guild_id = ? AND created_at >= ? GROUP BY target_id "
+                               "ORDER BY total DESC LIMIT ?", (guild_id, since, limit))
+
+    async def counts(self, guild_id: int, since: float, bucket: float) -> List[Tuple[float, int]]:
+        """Returns the amount of infractions since a unix timestamp per `bucket` seconds as (start, count)."""
+        await self.flush()
+        rows = await self._run(self._query,
+                               "SELECT CAST((created_at - ?) / ? AS INTEGER) AS slot, COUNT(*) FROM infractions "
+                               "WHERE guild_id = ? AND created_at >= ? GROUP BY slot ORDER BY slot",
+                               (since, bucket, guild_id, since))
+        return [(since + slot * bucket, count) for slot, count in rows]
@@ -0,0 +1,320 @@
+"""Offline benchmarks for the purge path.
+
+Runs `clean_channel` and `Purge.daily_purge` against in-process fake channels that
+apply bulk delete rules and per-route rate limits, so purge throughput can be measured
+without a live guild. Run it with `python -m purge.benchmark` from the repository root.
+
+All simulated latencies and rate limit windows are multiplied by `--time-scale`, and the
+purge rate limiter is scaled to match, so results are comparable between scales.
+"""
+import argparse
+import asyncio
+import bisect
+import random
+import time
+from datetime import datetime, timedelta
+
+import discord
+
+from . import purge as purge_module
+from .engine import SingleDeleteQueue, bulk_window, clean_channel
+from .filters import compile_filters
+from .jobs import JobTracker
+from .ratelimit import RateLimiter, global_rate, route_limits, route_period, route_rate
+from .scheduler import PurgeScheduler
+
+DISCORD_EPOCH = 1420070400000
+
+#: Simulated Discord limits per route of a channel: (requests, window in seconds).
+fake_route_limits = {
+    'history': (5, 5.0),
+    'bulk': (1, 1.0),
+    'delete': (5, 5.0),
+    'send': (5, 5.0),
+}
+
+#: Simulated latency of a single API call in seconds.
+fake_latency = 0.05
+
+#: The filter rules used to compare a filtered purge against an unfiltered one.
+benchmark_filters = {'keep_pinned': True, 'keep_roles': [2], 'pattern': r'https?://'}
+
+FAKE_CONTENTS = ['hello there', 'see https://example.com', 'lol', 'check http://example.org/a?b=c', 'ok ' * 40]
+
+
+def snowflake(created_at, sequence=0):
+    ms = int((created_at - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return ((ms - DISCORD_EPOCH) << 22) + (sequence & 0x3FFFFF)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Stats:
+    def __init__(self):
+        self.calls = 0
+        self.rate_limited = 0
+        self.latencies = []
+        self.deleted = 0
+
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+
+
+class FakeAuthor:
+    def __init__(self, author_id):
+        self.id = author_id
+        self.roles = [FakeRole(1)] + ([FakeRole(2)] if author_id % 7 == 0 else [])
+
+
+FAKE_AUTHORS = [FakeAuthor(author_id) for author_id in range(50)]
+
+
+class FakeMessage:
+    """A message whose content, author, attachments and pin state are derived from its ID."""
+
+    __slots__ = ('id', 'created_at', 'channel', 'content', 'author', 'attachments', 'pinned')
+
+    def __init__(self, message_id, created_at, channel):
+        self.id = message_id
+        self.created_at = created_at
+        self.channel = channel
+        self.content = FAKE_CONTENTS[message_id % len(FAKE_CONTENTS)]
+        self.author = FAKE_AUTHORS[message_id % len(FAKE_AUTHORS)]
+        self.attachments = [None] if message_id % 10 == 0 else []
+        self.pinned = message_id % 100 == 0
+
+    async def delete(self):
+        await self.channel._delete_one(self.id)
+
+
+class FakeHistory:
+    def __init__(self, channel, messages):
+        self.channel = channel
+        self.messages = messages
+
+    async def flatten(self):
+        await self.channel._request('history')
+        return self.messages
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeChannel:
+    """A text channel holding synthetic messages, with Discord-like bulk delete and rate limit rules."""
+
+    def __init__(self, channel_id, guild, stats, count, max_age, time_scale):
+        self.id = channel_id
+        self.guild = guild
+        self.mention = '<#{}>'.format(channel_id)
+        self.stats = stats
+        self.time_scale = time_scale
+        self._buckets = {}
+        now = datetime.utcnow()
+        ages = sorted((random.uniform(0, max_age.total_seconds()) for _ in range(count)), reverse=True)
+        self._ids = []
+        self._messages = {}
+        for sequence, age in enumerate(ages):
+            created_at = now - timedelta(seconds=age)
+            message_id = snowflake(created_at, sequence)
+            self._ids.append(message_id)
+            self._messages[message_id] = created_at
+        self._ids.sort()
+
+    async def _request(self, route):
+        """Simulates one API call: latency, plus 429 retries like discord.py does internally."""
+        start = time.perf_counter()
+        limit, window = fake_route_limits[route]
+        window *= self.time_scale
+        while True:
+            now = time.monotonic()
+            calls = [t for t in self._buckets.get(route, []) if now - t < window]
+            if len(calls) < limit:
+                calls.append(now)
+                self._buckets[route] = calls
+                break
+            self.stats.rate_limited += 1
+            await asyncio.sleep(window - (now - calls[0]))
+        await asyncio.sleep(fake_latency * self.time_scale)
+        self.stats.calls += 1
+        self.stats.latencies.append(time.perf_counter() - start)
+
+    def history(self, limit=100, after=None, oldest_first=True):
+        start = bisect.bisect_right(self._ids, after.id if after is not None else 0)
+        messages = []
+        for message_id in self._ids[start:]:
+            if message_id in self._messages:
+                messages.append(FakeMessage(message_id, self._messages[message_id], self))
+                if len(messages) == limit:
+                    break
+        return FakeHistory(self, messages)
+
+    async def delete_messages(self, messages):
+        if len(messages) == 1:
+            return await self._delete_one(messages[0].id)
+        if len(messages) > 100:
+            raise discord.ClientException('Can only bulk delete messages up to 100 messages')
+        cutoff = datetime.utcnow() - bulk_window
+        if any(self._messages.get(m.id, cutoff) <= cutoff for m in messages):
+            raise discord.ClientException('Bulk delete rejected a message older than 14 days')
+        await self._request('bulk')
+        for message in messages:
+            if self._messages.pop(message.id, None) is not None:
+                self.stats.deleted += 1
+
+    async def _delete_one(self, message_id):
+        await self._request('delete')
+        if self._messages.pop(message_id, None) is not None:
+            self.stats.deleted += 1
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, None, self)
+
+    async def send(self, content=None, **kwargs):
+        await self._request('send')
+
+
+class FakeFilters:
+    """Stands in for the Config backed filter cache, applying the same predicate to every channel."""
+
+    def __init__(self, predicate=None):
+        self.predicate = predicate
+
+    async def get(self, channel):
+        return self.predicate
+
+
+class FakeBot:
+    def __init__(self, channels):
+        self.channels = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+def scaled_limiter(time_scale):
+    limits = {kind: (rate, period * time_scale) for kind, (rate, period) in route_limits.items()}
+    return RateLimiter(global_rate, limits, route_rate, route_period * time_scale, global_period=time_scale)
+
+
+def report(name, stats, elapsed, channel_times=None):
+    per_1k = stats.calls / stats.deleted * 1000 if stats.deleted else 0.0
+    print('{}: {} messages in {:.2f}s, {:.0f} messages/sec, {:.1f} API calls per 1k messages, '
+          '{} rate limited'.format(name, stats.deleted, elapsed, stats.deleted / elapsed if elapsed else 0.0,
+                                   per_1k, stats.rate_limited))
+    print('    API call latency p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms'.format(
+        percentile(stats.latencies, 50) * 1000, percentile(stats.latencies, 99) * 1000,
+        max(stats.latencies, default=0.0) * 1000))
+    if channel_times:
+        print('    channel time p50 {:.2f}s, p99 {:.2f}s'.format(
+            percentile(channel_times, 50), percentile(channel_times, 99)))
+
+
+async def bench_clean_channel(args):
+    stats = Stats()
+    channel = FakeChannel(1, FakeGuild(1), stats, args.messages, timedelta(days=args.max_age), args.time_scale)
+    start = time.perf_counter()
+    await clean_channel(channel, scaled_limiter(args.time_scale))
+    report('clean_channel', stats, time.perf_counter() - start)
+
+
+async def bench_filters(args):
+    """Compares an unfiltered purge against one evaluating `benchmark_filters` during the scan."""
+    predicate = compile_filters(benchmark_filters)
+    for name, channel_predicate in [('unfiltered', None), ('filtered', predicate)]:
+        random.seed(args.seed)
+        stats = Stats()
+        channel = FakeChannel(1, FakeGuild(1), stats, args.messages, timedelta(days=min(args.max_age, 13)),
+                              args.time_scale)
+        start = time.perf_counter()
+        await clean_channel(channel, scaled_limiter(args.time_scale), predicate=channel_predicate)
+        report('clean_channel ({})'.format(name), stats, time.perf_counter() - start)
+
+    messages = [FakeMessage(message_id, None, None) for message_id in range(args.messages)]
+    start = time.perf_counter()
+    kept = sum(1 for message in messages if not predicate(message))
+    elapsed = time.perf_counter() - start
+    print('    predicate: {:.0f} messages/sec, {} of {} kept'.format(
+        len(messages) / elapsed if elapsed else 0.0, kept, len(messages)))
+
+
+def build_channels(args, stats):
+    channels = []
+    for guild_id in range(1, args.guilds + 1):
+        guild = FakeGuild(guild_id)
+        for index in range(args.channels):
+            channels.append(FakeChannel(guild_id * 1000 + index, guild, stats, args.messages // args.channels,
+                                        timedelta(days=args.max_age), args.time_scale))
+    return channels
+
+
+def build_cog(channels, time_scale):
+    """Builds a Purge cog around fake channels, without Config and without the timer."""
+    cog = purge_module.Purge.__new__(purge_module.Purge)
+    cog.bot = FakeBot(channels)
+    cog.limiter = scaled_limiter(time_scale)
+    cog.scheduler = PurgeScheduler(cog.bot)
+    cog.checkpoints = None
+    cog.old_queue = SingleDeleteQueue(cog.limiter)
+    cog.jobs = JobTracker()
+    cog.filters = FakeFilters()
+    return cog
+
+
+async def bench_daily_purge_by_guild(args):
+    """Purges guild by guild, as `purgedailynow` does."""
+    stats = Stats()
+    channels = build_channels(args, stats)
+    cog = build_cog(channels, args.time_scale)
+    start = time.perf_counter()
+    for guild_id in range(1, args.guilds + 1):
+        await cog.daily_purge({guild_id: [c.id for c in channels if c.guild.id == guild_id]})
+    await cog.old_queue.join()
+    report('Purge.daily_purge (guild by guild)', stats, time.perf_counter() - start,
+           [run.seconds for run in cog.jobs.history])
+
+
+async def bench_daily_purge(args):
+    """Purges all guilds at once, as the scheduled purge does."""
+    stats = Stats()
+    channels = build_channels(args, stats)
+    cog = build_cog(channels, args.time_scale)
+    guild_channels = {}
+    for channel in channels:
+        guild_channels.setdefault(channel.guild.id, []).append(channel.id)
+    start = time.perf_counter()
+    await cog.daily_purge(guild_channels)
+    await cog.old_queue.join()
+    report('Purge.daily_purge', stats, time.perf_counter() - start, [run.seconds for run in cog.jobs.history])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000, help='messages per channel benchmark and per guild')
+    parser.add_argument('--max-age', type=float, default=13, help='age of the oldest message in days')
+    parser.add_argument('--guilds', type=int, default=4)
+    parser.add_argument('--channels', type=int, default=8, help='channels per guild')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='multiplier for simulated time')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    purge_module.wait_period = 0
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(bench_clean_channel(args))
+    loop.run_until_complete(bench_filters(args))
+    loop.run_until_complete(bench_daily_purge_by_guild(args))
+    loop.run_until_complete(bench_daily_purge(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import time
+
+import discord
+
+
+class Checkpoints:
+    """Keeps a high-water mark per channel so that a purge only walks history it has not seen.
+
+    The mark is the ID of the newest message up to which every message has been deleted. It is
+    advanced after every batch, so an interrupted purge resumes from where it stopped. Messages
+    still waiting in the single delete queue hold the mark back until they are deleted.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.config.register_channel(purge_mark=0, purge_started=0, purge_completed=0)
+        self._scanned = {}
+
+    async def start(self, channel):
+        """Marks a purge as started and returns the point in history to continue from."""
+        channel_config = self.config.channel(channel)
+        await channel_config.purge_started.set(time.time())
+        return discord.Object(id=await channel_config.purge_mark())
+
+    async def advance(self, channel, scanned_id, pending_id=None):
+        """Advances the mark to the newest handled message, held back by the oldest pending one."""
+        self._scanned[channel.id] = scanned_id
+        mark = scanned_id if pending_id is None else min(scanned_id, pending_id - 1)
+        await self.config.channel(channel).purge_mark.set(mark)
+
+    async def release(self, channel):
+        """Advances the mark of a channel whose pending messages have all been deleted."""
+        scanned_id = self._scanned.pop(channel.id, None)
+        if scanned_id is not None:
+            await self.config.channel(channel).purge_mark.set(scanned_id)
+
+    async def reset(self, channel):
+        """Moves the mark back to the start of history, so the next purge looks at every message again."""
+        self._scanned.pop(channel.id, None)
+        await self.config.channel(channel).purge_mark.set(0)
+
+    async def abandon(self, channel):
+        """Marks a purge as cancelled, so it is not resumed. The next purge still starts from the mark."""
+        await self.config.channel(channel).purge_started.set(0)
+
+    async def complete(self, channel):
+        await self.config.channel(channel).purge_completed.set(time.time())
+
+    async def interrupted(self):
+        """Returns the IDs of channels whose last purge never completed."""
+        return [channel_id for channel_id, data in (await self.config.all_channels()).items()
+                if data['purge_started'] > data['purge_completed']]
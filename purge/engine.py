@@ -0,0 +1,180 @@
+import asyncio
+import bisect
+from collections import deque
+from datetime import datetime, timedelta
+
+import discord
+
+from .jobs import PurgeProgress
+from .ratelimit import RateLimiter
+
+#: Discord only allows bulk deleting messages younger than this.
+bulk_window = timedelta(days=14)
+
+#: Messages this close to leaving the bulk window are deleted one by one instead,
+#: so that they cannot age out between being scanned and being deleted.
+bulk_margin = timedelta(minutes=10)
+
+#: The largest amount of messages a single bulk delete accepts.
+bulk_size = 100
+
+OLDEST = discord.Object(id=0)
+
+
+async def history_pages(channel, after, limiter, progress):
+    """Yields the history after a given point one API page at a time, oldest first."""
+    cursor = after
+    while True:
+        progress.waits += await limiter.acquire(('history', channel.id))
+        page = await channel.history(limit=100, after=cursor, oldest_first=True).flatten()
+        progress.api_calls += 1
+        progress.scanned += len(page)
+        if page:
+            yield page
+        if len(page) < 100:
+            return
+        cursor = discord.Object(id=page[-1].id)
+
+
+async def bulk_delete(channel, messages, limiter, progress):
+    progress.waits += await limiter.acquire(('bulk' if len(messages) > 1 else 'delete', channel.id))
+    await channel.delete_messages(messages)
+    progress.api_calls += 1
+    progress.deleted += len(messages)
+
+
+class SingleDeleteQueue:
+    """Deletes messages that are too old for bulk deletion one by one in the background.
+
+    Only message IDs are queued, so a channel with a large backlog costs little memory.
+    Channels are drained round-robin so one large backlog does not hold up the others.
+    The pending IDs of a channel are kept in order, so the oldest one holds back its checkpoint.
+    """
+
+    def __init__(self, limiter, checkpoints=None):
+        self.limiter = limiter
+        self.checkpoints = checkpoints
+        self.deleted = 0
+        self._pending = {}
+        self._queued = {}
+        self._channels = {}
+        self._finished = set()
+        self._task = None
+
+    def put(self, channel, message_id):
+        """Queues a message for deletion. Returns False if it is still waiting to be deleted."""
+        queued = self._queued.setdefault(channel.id, set())
+        if message_id in queued:
+            return False
+        queued.add(message_id)
+        self._channels[channel.id] = channel
+        pending = self._pending.setdefault(channel.id, deque())
+        if pending and message_id < pending[-1]:
+            # Only a purge rescanning from a reset checkpoint queues out of order.
+            pending.insert(bisect.bisect(pending, message_id), message_id)
+        else:
+            pending.append(message_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._drain())
+        return True
+
+    def floor(self, channel_id):
+        """Returns the ID of the oldest message still waiting to be deleted in a channel."""
+        pending = self._pending.get(channel_id)
+        return pending[0] if pending else None
+
+    async def finish(self, channel):
+        """Completes the checkpoint of a channel once its backlog has been deleted."""
+        if channel.id in self._pending:
+            self._finished.add(channel.id)
+        elif self.checkpoints is not None:
+            await self.checkpoints.complete(channel)
+
+    async def join(self):
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _drain(self):
+        while self._pending:
+            for channel_id in list(self._pending):
+                pending = self._pending[channel_id]
+                channel = self._channels[channel_id]
+                message_id = pending[0]
+                await self.limiter.acquire(('delete', channel_id))
+                try:
+                    await channel.get_partial_message(message_id).delete()
+                    self.deleted += 1
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as e:
+                    print("Failed to delete message {} in {}: {}".format(message_id, channel_id, e))
+                # An older message may have been queued in front of it meanwhile.
+                pending.remove(message_id)
+                self._queued[channel_id].discard(message_id)
+                if not pending:
+                    await self._settle(channel)
+
+    async def _settle(self, channel):
+        del self._pending[channel.id]
+        del self._queued[channel.id]
+        del self._channels[channel.id]
+        if self.checkpoints is not None:
+            await self.checkpoints.release(channel)
+            if channel.id in self._finished:
+                await self.checkpoints.complete(channel)
+        self._finished.discard(channel.id)
+
+
+async def clean_channel(channel, limiter=None, checkpoints=None, old_queue=None, progress=None, keep=(),
+                        predicate=None):
+    """Deletes the history of a channel in a single pass.
+
+    Messages young enough for bulk deletion are deleted in batches of 100. Older messages
+    are handed to `old_queue`. Without a queue, the old messages are deleted before returning.
+    Messages whose IDs are in `keep`, or for which `predicate` returns False, are left alone.
+    The checkpoint is held back before the oldest message in `keep` or kept pinned message, so
+    a later purge still deletes it once it is no longer kept or pinned.
+    """
+    limiter = limiter or RateLimiter()
+    progress = progress or PurgeProgress()
+    local_queue = old_queue is None
+    if local_queue:
+        old_queue = SingleDeleteQueue(limiter, checkpoints)
+    after = OLDEST if checkpoints is None else await checkpoints.start(channel)
+    batch = []
+    scanned = None
+    held = None
+    async for page in history_pages(channel, after, limiter, progress):
+        cutoff = datetime.utcnow() - bulk_window + bulk_margin
+        for message in page:
+            if message.id in keep:
+                if held is None:
+                    held = message.id - 1
+                continue
+            if predicate is not None and not predicate(message):
+                if message.pinned and held is None:
+                    held = message.id - 1
+                continue
+            if message.created_at > cutoff:
+                batch.append(message)
+                if len(batch) == bulk_size:
+                    await bulk_delete(channel, batch, limiter, progress)
+                    batch = []
+            elif old_queue.put(channel, message.id):
+                progress.queued += 1
+        scanned = page[-1].id if held is None else min(page[-1].id, held)
+        if checkpoints is not None:
+            await checkpoints.advance(channel, min(batch[0].id - 1, scanned) if batch else scanned,
+                                      old_queue.floor(channel.id))
+    if batch:
+        await bulk_delete(channel, batch, limiter, progress)
+    if checkpoints is not None:
+        if scanned is not None:
+            await checkpoints.advance(channel, scanned, old_queue.floor(channel.id))
+        await old_queue.finish(channel)
+    if local_queue:
+        await old_queue.join()
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import discord
+
+from .engine import bulk_margin, bulk_size, bulk_window, history_pages
+from .jobs import PurgeProgress
+
+#: The amount of seconds expired messages are collected before they are deleted together.
+ephemeral_flush_interval = 2
+
+#: How far before the TTL window the startup scan of an ephemeral channel reaches, to catch
+#: messages posted while the bot was down.
+ephemeral_catchup = timedelta(days=1)
+
+
+class TimerWheel:
+    """A hierarchical timer wheel.
+
+    Level 0 has one slot per tick, and every level above covers `slots` times the span of the
+    one below it. Adding a timer is O(1), and timers are moved down a level when the wheel
+    reaches their slot, so each timer is touched at most once per level before it expires.
+    """
+
+    def __init__(self, now, resolution=1.0, slots=64, levels=4):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._tick = int(now / resolution)
+
+    def add(self, deadline, item):
+        self._place(max(int(deadline / self.resolution), self._tick + 1), item)
+
+    def _place(self, tick, item):
+        delta = tick - self._tick
+        for level in range(self.levels):
+            if delta < self._spans[level + 1]:
+                self._wheels[level][(tick // self._spans[level]) % self.slots].append((tick, item))
+                return
+        self._overflow.append((tick, item))
+
+    def _cascade(self, entries, expired):
+        for tick, item in entries:
+            if tick <= self._tick:
+                expired.append(item)
+            else:
+                self._place(tick, item)
+
+    def advance(self, now):
+        """Moves the wheel forward to a given time and returns the items that expired."""
+        expired = []
+        target = int(now / self.resolution)
+        while self._tick < target:
+            self._tick += 1
+            if self._tick % self._spans[self.levels] == 0:
+                overflow, self._overflow = self._overflow, []
+                self._cascade(overflow, expired)
+            for level in range(self.levels - 1, 0, -1):
+                if self._tick % self._spans[level] == 0:
+                    wheel = self._wheels[level]
+                    slot = (self._tick // self._spans[level]) % self.slots
+                    entries, wheel[slot] = wheel[slot], []
+                    self._cascade(entries, expired)
+            wheel = self._wheels[0]
+            slot = self._tick % self.slots
+            entries, wheel[slot] = wheel[slot], []
+            expired.extend(item for _, item in entries)
+        return expired
+
+
+class EphemeralPurger:
+    """Deletes each message in an ephemeral channel a fixed amount of time after it was posted.
+
+    Expiry times are kept in a timer wheel fed by the message listener. Expired messages are
+    collected for `ephemeral_flush_interval` seconds and bulk deleted together per channel.
+    Every message has one live timer. Changing a channel's TTL starts a new generation of its
+    timers, and timers of older generations are dropped when they come up.
+    """
+
+    def __init__(self, bot, config, limiter, old_queue, filters):
+        self.bot = bot
+        self.config = config
+        self.config.register_channel(ephemeral_ttl=0)
+        self.limiter = limiter
+        self.old_queue = old_queue
+        self.filters = filters
+        self.ttls = {}
+        # The creation time of every message with a live timer, by channel ID and message ID.
+        self.pending = {}
+        self.generations = {}
+        self.wheel = TimerWheel(time.time())
+
+    async def load(self):
+        """Loads the TTL of every ephemeral channel and rebuilds their timers from recent history."""
+        channels_data = await self.config.all_channels()
+        self.ttls = {channel_id: data['ephemeral_ttl'] for channel_id, data in channels_data.items()
+                     if data['ephemeral_ttl']}
+        for channel_id in list(self.ttls):
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                await self.rebuild(channel)
+
+    async def rebuild(self, channel):
+        ttl = self.ttls[channel.id] * 60
+        after = discord.Object(id=discord.utils.time_snowflake(
+            datetime.utcnow() - timedelta(seconds=ttl) - ephemeral_catchup))
+        try:
+            async for page in history_pages(channel, after, self.limiter, PurgeProgress()):
+                for message in page:
+                    await self.track(message)
+        except discord.HTTPException as e:
+            print("Failed to scan ephemeral channel {}: {}".format(channel.id, e))
+
+    async def set_ttl(self, channel, minutes):
+        await self.config.channel(channel).ephemeral_ttl.set(minutes)
+        generation = self.generations[channel.id] = self.generations.get(channel.id, 0) + 1
+        if minutes:
+            self.ttls[channel.id] = minutes
+            for message_id, created in self.pending.get(channel.id, {}).items():
+                self.wheel.add(created + minutes * 60, (channel.id, generation, message_id))
+            await self.rebuild(channel)
+        else:
+            self.ttls.pop(channel.id, None)
+            self.pending.pop(channel.id, None)
+
+    async def track(self, message):
+        """Starts the timer of a message if it was posted in an ephemeral channel and passes its filters."""
+        ttl = self.ttls.get(message.channel.id)
+        if not ttl or message.pinned:
+            return
+        pending = self.pending.setdefault(message.channel.id, {})
+        if message.id in pending:
+            return
+        predicate = await self.filters.get(message.channel)
+        if predicate is None or predicate(message):
+            created = (message.created_at - datetime(1970, 1, 1)).total_seconds()
+            pending[message.id] = created
+            generation = self.generations.get(message.channel.id, 0)
+            self.wheel.add(created + ttl * 60, (message.channel.id, generation, message.id))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(ephemeral_flush_interval)
+            expired = {}
+            for channel_id, generation, message_id in self.wheel.advance(time.time()):
+                if generation != self.generations.get(channel_id, 0) or channel_id not in self.ttls:
+                    continue
+                if self.pending.get(channel_id, {}).pop(message_id, None) is not None:
+                    expired.setdefault(channel_id, []).append(message_id)
+            for channel_id, message_ids in expired.items():
+                channel = self.bot.get_channel(channel_id)
+                if channel is not None:
+                    await self.flush(channel, message_ids)
+
+    async def flush(self, channel, message_ids):
+        cutoff = discord.utils.time_snowflake(datetime.utcnow() - bulk_window + bulk_margin)
+        young = [discord.Object(id=message_id) for message_id in message_ids if message_id > cutoff]
+        for message_id in message_ids:
+            if message_id <= cutoff:
+                self.old_queue.put(channel, message_id)
+        for index in range(0, len(young), bulk_size):
+            batch = young[index:index + bulk_size]
+            await self.limiter.acquire(('bulk' if len(batch) > 1 else 'delete', channel.id))
+            try:
+                await channel.delete_messages(batch)
+            except discord.NotFound:
+                pass
+            except discord.HTTPException as e:
+                print("Failed to delete expired messages in {}: {}".format(channel.id, e))
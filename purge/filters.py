@@ -0,0 +1,94 @@
+import re
+
+#: The filter rules of a channel that has none. Every message is purged.
+default_filters = {
+    'keep_pinned': False,
+    'keep_authors': [],
+    'keep_roles': [],
+    'pattern': None,
+    'attachments_only': False,
+}
+
+
+def compile_filters(rules):
+    """Compiles the filter rules of a channel into a single predicate telling whether to delete a message.
+
+    Returns None if no rules are set, so the purge can skip calling it entirely. The checks are
+    ordered from cheapest to most expensive, and the regex is only compiled once here.
+    """
+    keep_pinned = rules.get('keep_pinned', False)
+    keep_authors = frozenset(rules.get('keep_authors', ()))
+    keep_roles = frozenset(rules.get('keep_roles', ()))
+    pattern = re.compile(rules['pattern']).search if rules.get('pattern') else None
+    attachments_only = rules.get('attachments_only', False)
+    if not (keep_pinned or keep_authors or keep_roles or pattern or attachments_only):
+        return None
+
+    def should_delete(message):
+        if keep_pinned and message.pinned:
+            return False
+        if attachments_only and not message.attachments:
+            return False
+        if keep_authors and message.author.id in keep_authors:
+            return False
+        if keep_roles and not keep_roles.isdisjoint(role.id for role in getattr(message.author, 'roles', ())):
+            return False
+        if pattern is not None and not pattern(message.content):
+            return False
+        return True
+
+    return should_delete
+
+
+def describe_filters(rules, guild):
+    lines = []
+    if rules.get('keep_pinned'):
+        lines.append('Pinned messages are kept.')
+    if rules.get('keep_authors'):
+        lines.append('Messages by {} are kept.'.format(', '.join('<@{}>'.format(a) for a in rules['keep_authors'])))
+    if rules.get('keep_roles'):
+        lines.append('Messages by members with {} are kept.'.format(', '.join(
+            guild.get_role(r).name if guild.get_role(r) else str(r) for r in rules['keep_roles'])))
+    if rules.get('pattern'):
+        lines.append('Only messages matching `{}` are purged.'.format(rules['pattern']))
+    if rules.get('attachments_only'):
+        lines.append('Only messages with attachments are purged.')
+    return lines
+
+
+class FilterCache:
+    """Keeps the compiled filter predicate of every channel, compiling each one only when it changes."""
+
+    def __init__(self, config, checkpoints):
+        self.config = config
+        self.config.register_channel(purge_filters=default_filters)
+        self.checkpoints = checkpoints
+        self._compiled = {}
+
+    async def get(self, channel):
+        if channel.id not in self._compiled:
+            self._compiled[channel.id] = compile_filters(await self.config.channel(channel).purge_filters())
+        return self._compiled[channel.id]
+
+    async def rules(self, channel):
+        return await self.config.channel(channel).purge_filters()
+
+    async def set(self, channel, rules):
+        """Stores new rules. Raises ValueError if the pattern is not a valid regex.
+
+        The purge mark of the channel is reset, so messages kept by the old rules are checked again.
+        """
+        if rules.get('pattern'):
+            try:
+                re.compile(rules['pattern'])
+            except re.error as e:
+                raise ValueError('Invalid pattern: {}'.format(e))
+        await self.config.channel(channel).purge_filters.set(rules)
+        await self.checkpoints.reset(channel)
+        self._compiled[channel.id] = compile_filters(rules)
+
+
+def mentioned_id(value):
+    """Extracts an ID from a mention or a raw ID, or returns None."""
+    match = re.search(r'\d{15,21}', value or '')
+    return int(match.group(0)) if match else None
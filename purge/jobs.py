@@ -0,0 +1,160 @@
+import asyncio
+import itertools
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+import discord
+
+#: The amount of seconds between edits of a job's status message.
+progress_interval = 5
+
+#: The amount of finished channel purges remembered for `purgehistory`.
+run_history_size = 500
+
+#: A finished purge of a single channel.
+ChannelRun = namedtuple('ChannelRun', 'channel_id guild_id started_at seconds scanned deleted queued')
+
+
+class PurgeProgress:
+    """Counters of a purge of a single channel."""
+
+    __slots__ = ('scanned', 'deleted', 'queued', 'api_calls', 'waits')
+
+    def __init__(self):
+        self.scanned = 0
+        self.deleted = 0
+        self.queued = 0
+        self.api_calls = 0
+        self.waits = 0
+
+
+class PurgeJob:
+    """A running purge of one or more channels that can be followed and cancelled."""
+
+    def __init__(self, job_id, guild_ids, channels_total):
+        self.id = job_id
+        self.guild_ids = guild_ids
+        self.channels_total = channels_total
+        self.channels_done = 0
+        self.channels = []
+        self.state = 'running'
+        self.cancelled = False
+        self.cancelled_guilds = set()
+        self.started = time.monotonic()
+        self.task = None
+        # The guild ID and task of every channel that is being purged, by channel ID.
+        self.tasks = {}
+
+    def is_cancelled(self, guild_id):
+        return self.cancelled or guild_id in self.cancelled_guilds
+
+    def total(self, counter):
+        return sum(getattr(progress, counter) for progress in self.channels)
+
+    def describe(self):
+        return ('Purge #{} {}: {}/{} channels done, {} messages scanned, {} deleted, {} queued for single '
+                'deletion, {} API calls, {} rate limit waits, {:.0f} seconds elapsed.').format(
+            self.id, self.state, self.channels_done, self.channels_total, self.total('scanned'),
+            self.total('deleted'), self.total('queued'), self.total('api_calls'), self.total('waits'),
+            time.monotonic() - self.started
+        )
+
+
+class JobTracker:
+    """Keeps track of running purges and of how long past channel purges took."""
+
+    def __init__(self, history_size=run_history_size):
+        self.jobs = {}
+        self.history = deque(maxlen=history_size)
+        self.status_ids = set()
+        self._ids = itertools.count(1)
+
+    def start(self, guild_ids, channels_total, run, status_channel=None):
+        """Starts `run(job)` as a tracked job, reporting progress in `status_channel` if given."""
+        job = PurgeJob(next(self._ids), guild_ids, channels_total)
+        self.jobs[job.id] = job
+        job.task = asyncio.get_event_loop().create_task(self._run(job, run, status_channel))
+        return job
+
+    async def _run(self, job, run, status_channel):
+        message = None
+        reporter = None
+        try:
+            if status_channel is not None:
+                message = await status_channel.send(job.describe())
+                self.status_ids.add(message.id)
+                reporter = asyncio.get_event_loop().create_task(self._report(job, message))
+            await run(job)
+            job.state = 'finished'
+        except asyncio.CancelledError:
+            job.state = 'cancelled'
+        finally:
+            del self.jobs[job.id]
+            if reporter is not None:
+                reporter.cancel()
+            if message is not None:
+                self.status_ids.discard(message.id)
+                try:
+                    await message.edit(content=job.describe())
+                except discord.HTTPException:
+                    pass
+
+    async def _report(self, job, message):
+        while True:
+            await asyncio.sleep(progress_interval)
+            try:
+                await message.edit(content=job.describe())
+            except discord.NotFound:
+                return
+            except discord.HTTPException:
+                pass
+
+    async def track(self, job, channel, clean):
+        """Runs `clean(channel, progress)` as part of a job and records how long it took.
+
+        The channel is skipped, or its purge stopped, once its guild's part of the job is cancelled.
+        """
+        if job.is_cancelled(channel.guild.id):
+            return
+        progress = PurgeProgress()
+        job.channels.append(progress)
+        started_at = datetime.utcnow()
+        start = time.monotonic()
+        task = asyncio.ensure_future(clean(channel, progress))
+        job.tasks[channel.id] = (channel.guild.id, task)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            del job.tasks[channel.id]
+        if task.cancelled():
+            return
+        task.result()
+        job.channels_done += 1
+        self.history.append(ChannelRun(channel.id, channel.guild.id, started_at, time.monotonic() - start,
+                                       progress.scanned, progress.deleted, progress.queued))
+
+    def cancel(self, guild_id):
+        """Cancels the purges of a guild's channels. Returns how many running jobs were affected.
+
+        Jobs that only cover the guild are cancelled as a whole. Jobs shared with other guilds, like
+        scheduled purges, stop the guild's running channels and skip the rest of them.
+        """
+        jobs = [job for job in self.jobs.values() if guild_id in job.guild_ids and not job.is_cancelled(guild_id)]
+        for job in jobs:
+            if job.guild_ids == {guild_id}:
+                job.cancelled = True
+                job.task.cancel()
+                continue
+            job.cancelled_guilds.add(guild_id)
+            for channel_guild_id, task in job.tasks.values():
+                if channel_guild_id == guild_id:
+                    task.cancel()
+        return len(jobs)
+
+    def slowest(self, guild_id=None, count=10):
+        runs = [run for run in self.history if guild_id is None or run.guild_id == guild_id]
+        return sorted(runs, key=lambda run: run.seconds, reverse=True)[:count]
@@ -1,22 +1,32 @@
 import asyncio
-from datetime import datetime, timedelta, time
+from copy import deepcopy
+from datetime import datetime, time, timezone
+
 from redbot.core import commands, Config, checks
 
-#: The timestamp to begin the daily purge. (E.g. 23:30:00 -> time(23, 30, 0))
+from .checkpoint import Checkpoints
+from .engine import SingleDeleteQueue, clean_channel
+from .ephemeral import EphemeralPurger
+from .filters import FilterCache, default_filters, describe_filters, mentioned_id
+from .jobs import JobTracker
+from .ratelimit import RateLimiter
+from .registry import ChannelRegistry
+from .schedule import PurgeTimer, Schedule
+from .scheduler import PurgeScheduler
+
+#: The default timestamp to begin the daily purge of a channel. (E.g. 23:30:00 -> time(23, 30, 0))
 purge_time = time(23, 30, 0)
 
 #: The amount of minutes to wait after warning that a purge is coming up and actually purging.
 wait_period = 5
 
-
-async def clean_channel(channel):
-    await channel.purge(after=datetime.now() - timedelta(days=14))
+#: The default amount of minutes a purge may randomly be delayed to spread out the load.
+purge_jitter = 0
 
 
-async def _daily_purge(channel):
+async def _warn_channel(channel, limiter):
+    await limiter.acquire(('send', channel.id))
     await channel.send("This channel will be purged in {} minutes.".format(wait_period))
-    await asyncio.sleep(wait_period * 60)
-    await clean_channel(channel)
 
 
 def response_check(message):
@@ -30,8 +40,30 @@ class Purge(commands.Cog):
         super().__init__()
         self.config = Config.get_conf(self, identifier=1170348762)
         self.config.register_guild(channels=[])
+        self.config.register_channel(purge_schedule={})
         self.bot = bot
-        self.bot.loop.create_task(self.daily_loop())
+        self.limiter = RateLimiter()
+        self.scheduler = PurgeScheduler(bot)
+        self.registry = ChannelRegistry(self.config)
+        self.checkpoints = Checkpoints(self.config)
+        self.filters = FilterCache(self.config, self.checkpoints)
+        self.old_queue = SingleDeleteQueue(self.limiter, self.checkpoints)
+        self.ephemeral = EphemeralPurger(bot, self.config, self.limiter, self.old_queue, self.filters)
+        self.timer = PurgeTimer(self.on_due)
+        self.jobs = JobTracker()
+        self.tasks = [
+            self.bot.loop.create_task(self.resume_interrupted()),
+            self.bot.loop.create_task(self.schedule_loop()),
+            self.bot.loop.create_task(self.ephemeral_loop()),
+        ]
+
+    def cog_unload(self):
+        for task in self.tasks:
+            task.cancel()
+        for job in list(self.jobs.jobs.values()):
+            job.task.cancel()
+        self.old_queue.stop()
+        self.registry.close()
 
     @commands.command(no_pm=True)
     @checks.admin()
@@ -43,7 +75,7 @@ class Purge(commands.Cog):
         response = await self.bot.wait_for('message', check=response_check(ctx.message))
 
         if response.content.lower().strip() == "yes":
-            await clean_channel(ctx.channel)
+            self.start_purge({ctx.guild.id: [ctx.channel.id]}, ctx.channel, warn=False)
         else:
             await ctx.send("Aborting purge.")
 
@@ -58,20 +90,41 @@ class Purge(commands.Cog):
         response = await ctx.bot.wait_for('message', check=response_check(ctx.message))
 
         if response.content.lower().strip() == "yes":
-            channels = await self.config.guild(ctx.guild).channels()
-            await self.daily_purge_channels(channels)
+            channels = await self.registry.channels(ctx.guild.id)
+            self.start_purge({ctx.guild.id: list(channels)}, ctx.channel)
         else:
             await ctx.send("Aborting daily purge.")
 
+    @commands.command(no_pm=True)
+    @checks.admin()
+    async def purgecancel(self, ctx):
+        """Cancels the running purges started in this server."""
+        cancelled = self.jobs.cancel(ctx.guild.id)
+        if cancelled:
+            await ctx.send('Cancelled {} running purges.'.format(cancelled))
+        else:
+            await ctx.send('There are no running purges in this server.')
+
+    @commands.command(no_pm=True)
+    @checks.admin()
+    async def purgehistory(self, ctx):
+        """Lists the recent channel purges in this server that took the longest."""
+        runs = self.jobs.slowest(ctx.guild.id)
+        if not runs:
+            await ctx.send("I haven't purged any channels in this server recently.")
+        else:
+            await ctx.send('The slowest recent purges:\n{}'.format("\n".join(
+                '<#{}>: {:.1f} seconds, {} deleted, {} queued for single deletion ({} UTC)'.format(
+                    run.channel_id, run.seconds, run.deleted, run.queued, run.started_at.strftime('%Y-%m-%d %H:%M'))
+                for run in runs
+            )))
+
     @commands.command(no_pm=True)
     @checks.admin()
     async def purgeadd(self, ctx):
         """Adds this channel to the daily purge."""
-        guild_config = self.config.guild(ctx.guild)
-        channels = await guild_config.channels()
-        if ctx.channel.id not in channels:
-            channels.append(ctx.channel.id)
-            await guild_config.channels.set(channels)
+        if await self.registry.add(ctx.guild.id, ctx.channel.id):
+            self._schedule(ctx.channel.id, await self._get_schedule(ctx.channel))
             await ctx.send('I will now purge {} daily.'.format(ctx.channel.mention))
         else:
             await ctx.send('I am already purging {} daily.'.format(ctx.channel.mention))
@@ -80,20 +133,123 @@ class Purge(commands.Cog):
     @checks.admin()
     async def purgeremove(self, ctx):
         """Removes this channel from the daily purge."""
-        channels = await self.config.guild(ctx.guild).channels()
-        if ctx.channel.id not in channels:
+        if not await self.registry.remove(ctx.guild.id, ctx.channel.id):
             await ctx.send('I am not purging {} daily.'.format(ctx.channel.mention))
         else:
-            channels.remove(ctx.channel.id)
-            await self.config.guild(ctx.guild).channels.set(channels)
+            self.timer.cancel(ctx.channel.id)
             await ctx.send('I am no longer purging {} daily.'.format(ctx.channel.mention))
 
+    @commands.command(no_pm=True)
+    @checks.admin()
+    async def purgeschedule(self, ctx, time_of_day=None, interval: int = 24, timezone_name=None, jitter: int = 0):
+        """Shows or sets when this channel is purged.
+
+        The time of day is given as HH:MM, the interval in hours, the timezone as e.g. Europe/Copenhagen,
+        and the jitter as the maximum amount of minutes the purge may randomly be delayed.
+        """
+        if time_of_day is None:
+            schedule = await self._get_schedule(ctx.channel)
+            await ctx.send('I purge {} {}.'.format(ctx.channel.mention, schedule.describe()))
+            return
+        try:
+            schedule = Schedule(datetime.strptime(time_of_day, '%H:%M').time(), interval, timezone_name, jitter)
+        except ValueError as e:
+            await ctx.send('That is not a valid schedule: {}'.format(e))
+            return
+        await self.config.channel(ctx.channel).purge_schedule.set(schedule.to_config())
+        if await self.registry.contains(ctx.guild.id, ctx.channel.id):
+            self._schedule(ctx.channel.id, schedule)
+        await ctx.send('I will purge {} {}.'.format(ctx.channel.mention, schedule.describe()))
+
+    @commands.command(no_pm=True)
+    @checks.admin()
+    async def purgefilter(self, ctx, rule=None, *, value=None):
+        """Shows or changes which messages are purged in this channel.
+
+        Rules:
+         - `pinned` toggles keeping pinned messages.
+         - `author <user>` toggles keeping the messages of a user.
+         - `role <role>` toggles keeping the messages of members with a role.
+         - `pattern [regex]` only purges messages matching the regex. Leave it out to purge all.
+         - `attachments` toggles only purging messages with attachments.
+         - `clear` removes all rules.
+        """
+        rules = await self.filters.rules(ctx.channel)
+        if rule is None:
+            await self._send_filters(ctx, rules)
+            return
+        rule = rule.lower()
+        if rule == 'pinned':
+            rules['keep_pinned'] = not rules['keep_pinned']
+        elif rule == 'attachments':
+            rules['attachments_only'] = not rules['attachments_only']
+        elif rule == 'pattern':
+            rules['pattern'] = value
+        elif rule in ['author', 'role']:
+            target = mentioned_id(value)
+            if target is None:
+                await ctx.send('You must mention a {} or give its ID.'.format(rule))
+                return
+            ids = rules['keep_authors' if rule == 'author' else 'keep_roles']
+            if target in ids:
+                ids.remove(target)
+            else:
+                ids.append(target)
+        elif rule == 'clear':
+            rules = deepcopy(default_filters)
+        else:
+            await ctx.send('That is not a valid rule. Use `pinned`, `author`, `role`, `pattern`, `attachments`, '
+                           'or `clear`.')
+            return
+        try:
+            await self.filters.set(ctx.channel, rules)
+        except ValueError as e:
+            await ctx.send(str(e))
+            return
+        await self._send_filters(ctx, rules)
+
+    async def _send_filters(self, ctx, rules):
+        lines = describe_filters(rules, ctx.guild)
+        if lines:
+            await ctx.send('\n'.join(lines))
+        else:
+            await ctx.send('I purge all messages in {}.'.format(ctx.channel.mention))
+
+    @commands.command(no_pm=True)
+    @checks.admin()
+    async def purgettl(self, ctx, minutes: int = None):
+        """Shows or sets how many minutes messages in this channel live before they are deleted.
+
+        Set it to 0 to stop deleting messages continuously.
+        """
+        if minutes is None:
+            ttl = self.ephemeral.ttls.get(ctx.channel.id)
+            if ttl:
+                await ctx.send('Messages in {} are deleted {} minutes after they are posted.'.format(
+                    ctx.channel.mention, ttl))
+            else:
+                await ctx.send('Messages in {} are not deleted continuously.'.format(ctx.channel.mention))
+        elif minutes < 0:
+            await ctx.send('The amount of minutes cannot be negative.')
+        elif minutes == 0:
+            await self.ephemeral.set_ttl(ctx.channel, 0)
+            await ctx.send('Messages in {} are no longer deleted continuously.'.format(ctx.channel.mention))
+        else:
+            await self.ephemeral.set_ttl(ctx.channel, minutes)
+            await ctx.send('Messages in {} will now be deleted {} minutes after they are posted.'.format(
+                ctx.channel.mention, minutes))
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        """Starts the timers of messages posted in ephemeral channels."""
+        if message.guild is not None:
+            await self.ephemeral.track(message)
+
     @commands.command(no_pm=True)
     @checks.admin()
     async def purging(self, ctx):
         """Checks if this channel is being purged daily."""
-        channels = await self.config.guild(ctx.guild).channels()
-        if ctx.guild.id in channels:
+        if await self.registry.contains(ctx.guild.id, ctx.channel.id):
             await ctx.send("I purge {} daily.".format(ctx.channel.mention))
         else:
             await ctx.send("I don't purge {} daily.".format(ctx.channel.mention))
@@ -102,37 +258,104 @@ class Purge(commands.Cog):
     @checks.admin()
     async def purgelist(self, ctx):
         """Lists all channels that are being purged daily on this server."""
-        await self._clean_channels_list(ctx.guild)
-        channels = await self.config.guild(ctx.guild).channels()
+        await self.registry.prune(ctx.guild.id, lambda c: self.bot.get_channel(c) is not None)
+        channels = await self.registry.channels(ctx.guild.id)
         if len(channels) == 0:
             await ctx.send("I don't purge any channels in this server.")
         else:
             channels_mentions = "\n".join([ctx.guild.get_channel(c).mention for c in channels])
             await ctx.send('I purge the following channels:\n{}'.format(channels_mentions))
 
-    async def _clean_channels_list(self, guild):
-        guild_config = self.config.guild(guild)
-        channels = await guild_config.channels()
-        await guild_config.channels.set([c for c in channels if self.bot.get_channel(c) is not None])
-
-    async def daily_purge_channels(self, channels):
-        tasks = []
-        for channel_id in channels:
-            tasks.append(_daily_purge(self.bot.get_channel(channel_id)))
-        await asyncio.gather(*tasks)
-
-    async def daily_loop(self):
-        while True:
-            date = datetime.now().date()
-            next_execution = datetime.combine(date, purge_time)
-            if next_execution < datetime.now():
-                next_execution += timedelta(days=1)
-            seconds_remaining = (next_execution - datetime.now()).seconds
-            print("Preparing to execute daily purge in {} seconds.".format(seconds_remaining))
-            await asyncio.sleep(seconds_remaining)
-            print("Start daily purge.")
-            tasks = []
-            guilds_data = await self.config.all_guilds()
-            for guild_id, data in guilds_data.items():
-                await self.daily_purge_channels(data["channels"])
-            await asyncio.gather(*tasks)
+    async def daily_purge(self, guild_channels, status_channel=None):
+        """Warns and then purges the channels of a guild ID -> channel IDs mapping."""
+        await self.start_purge(guild_channels, status_channel).task
+
+    def start_purge(self, guild_channels, status_channel=None, *, warn=True):
+        """Starts purging the channels of a guild ID -> channel IDs mapping as a tracked job."""
+        total = sum(len(c) for c in guild_channels.values())
+
+        async def run(job):
+            async def warn_channel(channel):
+                if not job.is_cancelled(channel.guild.id):
+                    await _warn_channel(channel, self.limiter)
+
+            if warn:
+                await self.scheduler.run(guild_channels, warn_channel)
+                await asyncio.sleep(wait_period * 60)
+            elapsed = await self.scheduler.run(
+                guild_channels, lambda c: self.jobs.track(job, c, lambda ch, progress: self._clean(ch, progress, job))
+            )
+            print("Purged {} of {} channels across {} guilds in {:.1f} seconds.".format(
+                job.channels_done, total, len(set(guild_channels) - job.cancelled_guilds), elapsed))
+
+        return self.jobs.start(set(guild_channels), total, run, status_channel)
+
+    async def _clean(self, channel, progress=None, job=None):
+        try:
+            await clean_channel(channel, self.limiter, self.checkpoints, self.old_queue, progress,
+                                self.jobs.status_ids, await self.filters.get(channel))
+        except asyncio.CancelledError:
+            if job is not None and job.is_cancelled(channel.guild.id):
+                await self.checkpoints.abandon(channel)
+            raise
+
+    async def resume_interrupted(self):
+        """Resumes purges that were cut off, e.g. by a restart."""
+        await self.bot.wait_until_ready()
+        guild_channels = {}
+        for channel_id in await self.checkpoints.interrupted():
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                guild_channels.setdefault(channel.guild.id, []).append(channel_id)
+        if guild_channels:
+            print("Resuming {} interrupted purges.".format(sum(len(c) for c in guild_channels.values())))
+            await self.start_purge(guild_channels, warn=False).task
+
+    async def _get_schedule(self, channel):
+        return Schedule.from_config(await self.config.channel(channel).purge_schedule(), purge_time, purge_jitter)
+
+    def _schedule(self, channel_id, schedule):
+        self.timer.schedule(channel_id, schedule.next_timestamp(datetime.now(timezone.utc), wait_period * 60))
+
+    async def load_schedules(self):
+        """Loads the schedules of all purged channels into the timer."""
+        guild_channels = await self.registry.all()
+        channels_data = await self.config.all_channels()
+        now = datetime.now(timezone.utc)
+        # Most channels share a schedule, so the next run is only computed once per distinct schedule.
+        runs = {}
+        entries = []
+        for channels in guild_channels.values():
+            for channel_id in channels:
+                schedule_data = channels_data.get(channel_id, {}).get('purge_schedule') or {}
+                key = tuple(sorted(schedule_data.items()))
+                if key not in runs:
+                    schedule = Schedule.from_config(schedule_data, purge_time, purge_jitter)
+                    runs[key] = (schedule, schedule.next_timestamp(now, wait_period * 60, jitter=False))
+                schedule, run = runs[key]
+                entries.append((schedule.jittered(run), channel_id))
+        self.timer.load(entries)
+
+    async def ephemeral_loop(self):
+        await self.bot.wait_until_ready()
+        await self.ephemeral.load()
+        print("Loaded {} ephemeral channels.".format(len(self.ephemeral.ttls)))
+        await self.ephemeral.run()
+
+    async def schedule_loop(self):
+        await self.load_schedules()
+        print("Loaded {} purge schedules.".format(len(self.timer)))
+        await self.bot.wait_until_ready()
+        await self.timer.run()
+
+    async def on_due(self, channel_ids):
+        """Warns and purges channels whose schedule came up, and schedules their next purge."""
+        guild_channels = {}
+        for channel_id in channel_ids:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            guild_channels.setdefault(channel.guild.id, []).append(channel_id)
+            self._schedule(channel_id, await self._get_schedule(channel))
+        if guild_channels:
+            self.start_purge(guild_channels)
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import deque
+
+#: The amount of requests per second allowed across all routes. Discord's global limit is 50.
+global_rate = 45
+
+#: The amount of requests allowed on a route without an entry in `route_limits` per `route_period` seconds.
+route_rate = 5
+
+#: The length of the window of a route without an entry in `route_limits` in seconds.
+route_period = 5.0
+
+#: The requests allowed on a route of a single channel, by the kind of the route: (requests, window in seconds).
+route_limits = {
+    'history': (5, 5.0),
+    'bulk': (1, 1.0),
+    'delete': (5, 5.0),
+    'send': (5, 5.0),
+}
+
+#: The share of a window added on top of it, to absorb the delay between acquiring a request and
+#: Discord receiving it.
+window_margin = 0.1
+
+#: The amount of idle route buckets kept around before they are pruned.
+max_route_buckets = 1024
+
+
+class WindowBucket:
+    """Allows at most `limit` requests in any `period` seconds.
+
+    The times of the last `limit` requests are kept, and a request only goes out once the oldest
+    of them is a full period old, plus `window_margin`. That stays within Discord's fixed windows
+    wherever their reset falls, including right after the bucket is created.
+    """
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._expiry = period * (1 + window_margin)
+        self._times = deque(maxlen=limit)
+
+    def is_idle(self):
+        return not self._times or time.monotonic() - self._times[-1] >= self._expiry
+
+    def wait_time(self):
+        if len(self._times) < self.limit:
+            return 0
+        return max(0.0, self._times[0] + self._expiry - time.monotonic())
+
+    def consume(self):
+        self._times.append(time.monotonic())
+
+
+class RateLimiter:
+    """Throttles requests against a global bucket and a bucket per route.
+
+    A route is any hashable key, e.g. `('bulk', channel_id)`, mirroring how Discord
+    buckets requests by endpoint and channel. The first element of a tuple route picks
+    its limit from `limits`.
+    """
+
+    def __init__(self, rate=global_rate, limits=None, per_route=route_rate, period=route_period,
+                 global_period=1.0):
+        self._global = WindowBucket(rate, global_period)
+        self._limits = route_limits if limits is None else limits
+        self._default = (per_route, period)
+        self._routes = {}
+        self.requests = 0
+        self.waits = 0
+
+    def _route(self, route):
+        bucket = self._routes.get(route)
+        if bucket is None:
+            if len(self._routes) >= max_route_buckets:
+                self._routes = {k: b for k, b in self._routes.items() if not b.is_idle()}
+            kind = route[0] if isinstance(route, tuple) else route
+            bucket = WindowBucket(*self._limits.get(kind, self._default))
+            self._routes[route] = bucket
+        return bucket
+
+    async def acquire(self, route):
+        """Waits until a request can be made on the given route. Returns how many times it had to wait."""
+        bucket = self._route(route)
+        waits = 0
+        while True:
+            delay = max(self._global.wait_time(), bucket.wait_time())
+            if delay <= 0:
+                self._global.consume()
+                bucket.consume()
+                self.requests += 1
+                return waits
+            waits += 1
+            self.waits += 1
+            await asyncio.sleep(delay)
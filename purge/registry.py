@@ -0,0 +1,93 @@
+import asyncio
+
+import discord
+
+#: The amount of seconds changes to the registry are collected before they are written to Config.
+registry_flush_delay = 5
+
+
+class ChannelRegistry:
+    """An in-memory index of the purged channels of every guild.
+
+    The registry is loaded from Config once. Changes only mark their guild as dirty, and the
+    channel lists of dirty guilds are written back in one batch after `registry_flush_delay`.
+    """
+
+    def __init__(self, config, delay=registry_flush_delay):
+        self.config = config
+        self.delay = delay
+        self._channels = None
+        self._dirty = set()
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    async def load(self):
+        async with self._lock:
+            if self._channels is None:
+                self._channels = {guild_id: set(data['channels'])
+                                  for guild_id, data in (await self.config.all_guilds()).items()}
+
+    async def channels(self, guild_id):
+        """Returns the set of purged channel IDs in a guild. The set must not be modified."""
+        await self.load()
+        return self._channels.get(guild_id, frozenset())
+
+    async def all(self):
+        """Returns a guild ID -> channel IDs mapping of every purged channel."""
+        await self.load()
+        return {guild_id: list(channels) for guild_id, channels in self._channels.items() if channels}
+
+    async def contains(self, guild_id, channel_id):
+        return channel_id in await self.channels(guild_id)
+
+    async def add(self, guild_id, channel_id):
+        """Adds a channel. Returns False if it was already registered."""
+        await self.load()
+        channels = self._channels.setdefault(guild_id, set())
+        if channel_id in channels:
+            return False
+        channels.add(channel_id)
+        self._mark_dirty(guild_id)
+        return True
+
+    async def remove(self, guild_id, channel_id):
+        """Removes a channel. Returns False if it was not registered."""
+        await self.load()
+        channels = self._channels.get(guild_id)
+        if not channels or channel_id not in channels:
+            return False
+        channels.remove(channel_id)
+        self._mark_dirty(guild_id)
+        return True
+
+    async def prune(self, guild_id, exists):
+        """Removes the channels of a guild for which `exists(channel_id)` is false."""
+        await self.load()
+        channels = self._channels.get(guild_id)
+        if not channels:
+            return
+        missing = {channel_id for channel_id in channels if not exists(channel_id)}
+        if missing:
+            channels -= missing
+            self._mark_dirty(guild_id)
+
+    def _mark_dirty(self, guild_id):
+        self._dirty.add(guild_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_event_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Writes the channel lists of all dirty guilds to Config."""
+        while self._dirty:
+            guild_id = self._dirty.pop()
+            await self.config.guild(discord.Object(id=guild_id)).channels.set(sorted(self._channels[guild_id]))
+
+    def close(self):
+        """Cancels the pending delayed flush and writes out all changes right away."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        return asyncio.get_event_loop().create_task(self.flush())
@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+#: The longest time the timer sleeps before looking at the clock again, in seconds.
+max_sleep = 3600
+
+#: The day that schedules repeating every few hours count their runs from.
+schedule_epoch = date(2000, 1, 1)
+
+
+def _wall_clock(date, time_of_day, tz):
+    """Returns the aware datetime at which the wall clock in a timezone shows the given date and time."""
+    if tz is None:
+        return datetime.combine(date, time_of_day).astimezone()
+    return datetime.combine(date, time_of_day, tzinfo=tz)
+
+
+class Schedule:
+    """When a channel is purged: a time of day in a timezone, repeated every `interval` hours.
+
+    Without a timezone, the local time of the bot is used.
+    """
+
+    def __init__(self, time_of_day, interval=24, tz_name=None, jitter=0):
+        if interval < 1:
+            raise ValueError('The interval must be at least one hour.')
+        self.time = time_of_day
+        self.interval = interval
+        self.tz_name = tz_name
+        self.jitter = jitter
+        try:
+            self.tz = ZoneInfo(tz_name) if tz_name else None
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError('Unknown timezone: {}'.format(tz_name))
+
+    @classmethod
+    def from_config(cls, data, default_time, default_jitter=0):
+        if not data:
+            return cls(default_time, jitter=default_jitter)
+        return cls(
+            datetime.strptime(data['time'], '%H:%M').time(),
+            data.get('interval', 24),
+            data.get('timezone'),
+            data.get('jitter', default_jitter)
+        )
+
+    def to_config(self):
+        return {'time': self.time.strftime('%H:%M'), 'interval': self.interval, 'timezone': self.tz_name,
+                'jitter': self.jitter}
+
+    def describe(self):
+        every = 'day' if self.interval == 24 else '{} hours'.format(self.interval)
+        message = 'every {} from {} {}'.format(every, self.time.strftime('%H:%M'), self.tz_name or 'server time')
+        if self.jitter:
+            message += ' (up to {} minutes later)'.format(self.jitter)
+        return message
+
+    def next_run(self, after):
+        """Returns the first run strictly after an aware datetime."""
+        local = after.astimezone(self.tz)
+        if self.interval % 24 == 0:
+            # Whole days step on the wall clock so runs stay at the same local time across DST changes.
+            days = self.interval // 24
+            date = local.date() - timedelta(days=local.toordinal() % days)
+            run = _wall_clock(date, self.time, self.tz)
+            while run <= after:
+                date += timedelta(days=days)
+                run = _wall_clock(date, self.time, self.tz)
+            return run
+        # Other intervals count from a fixed day, so the runs stay evenly spaced from one call to the next.
+        step = timedelta(hours=self.interval)
+        run = _wall_clock(schedule_epoch, self.time, self.tz).astimezone(timezone.utc)
+        run += step * max(0, math.ceil((after - run) / step))
+        if run <= after:
+            run += step
+        return run
+
+    def next_timestamp(self, after, lead=0, jitter=True):
+        """Returns the POSIX timestamp `lead` seconds before the next run that is still that far away.
+
+        The jitter is added on top, so that channels sharing a schedule do not all fire at once.
+        """
+        run = self.next_run(after + timedelta(seconds=lead)).timestamp() - lead
+        return self.jittered(run) if jitter else run
+
+    def jittered(self, timestamp):
+        return timestamp + random.uniform(0, self.jitter * 60)
+
+
+class PurgeTimer:
+    """Fires channels at their scheduled times from a single heap.
+
+    Rescheduling or cancelling a channel leaves its old heap entry behind; stale entries are
+    skipped when they reach the top.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._current = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def load(self, entries):
+        """Replaces all timers with an iterable of (timestamp, channel ID) pairs."""
+        self._heap = []
+        self._current = {}
+        for when, channel_id in entries:
+            seq = next(self._counter)
+            self._current[channel_id] = seq
+            self._heap.append((when, seq, channel_id))
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def schedule(self, channel_id, when):
+        seq = next(self._counter)
+        self._current[channel_id] = seq
+        heapq.heappush(self._heap, (when, seq, channel_id))
+        self._wakeup.set()
+
+    def cancel(self, channel_id):
+        self._current.pop(channel_id, None)
+
+    def __len__(self):
+        return len(self._current)
+
+    def _pop_stale(self):
+        while self._heap and self._current.get(self._heap[0][2]) != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    async def run(self):
+        while True:
+            self._pop_stale()
+            delay = self._heap[0][0] - time.time() if self._heap else max_sleep
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = []
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, seq, channel_id = heapq.heappop(self._heap)
+                if self._current.get(channel_id) == seq:
+                    del self._current[channel_id]
+                    due.append(channel_id)
+            await self.callback(due)
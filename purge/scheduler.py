@@ -0,0 +1,45 @@
+import asyncio
+import time
+from itertools import chain, zip_longest
+
+import discord
+
+#: The amount of channels that are processed at the same time across all guilds.
+purge_workers = 8
+
+
+def interleave(groups):
+    """Interleaves lists round-robin so that no single list is drained before the others start."""
+    sentinel = object()
+    return [item for item in chain.from_iterable(zip_longest(*groups, fillvalue=sentinel)) if item is not sentinel]
+
+
+class PurgeScheduler:
+    """Runs a job for channels from many guilds through one bounded pool of workers."""
+
+    def __init__(self, bot, workers=purge_workers):
+        self.bot = bot
+        self.workers = workers
+
+    async def run(self, guild_channels, job):
+        """Runs `job(channel)` for every channel in a guild ID -> channel IDs mapping.
+
+        Channels are picked round-robin across guilds. Returns the wall time in seconds.
+        """
+        start = time.monotonic()
+        queue = asyncio.Queue()
+        for channel_id in interleave(list(guild_channels.values())):
+            queue.put_nowait(channel_id)
+
+        async def worker():
+            while not queue.empty():
+                channel = self.bot.get_channel(queue.get_nowait())
+                if channel is None:
+                    continue
+                try:
+                    await job(channel)
+                except discord.HTTPException as e:
+                    print("Failed to purge {}: {}".format(channel.id, e))
+
+        await asyncio.gather(*[worker() for _ in range(min(self.workers, queue.qsize()))])
+        return time.monotonic() - start
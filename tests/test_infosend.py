@@ -0,0 +1,148 @@
+import asyncio
+import io
+import itertools
+
+import discord
+
+from infoscreen.rules import INFO_IMAGE, INFO_TEXT, BaseScreen
+
+
+class FakeResponse:
+    status = 404
+    reason = 'Not Found'
+
+
+class FakeImages:
+    async def fetch_all(self, urls):
+        return {url: io.BytesIO(b'image') for url in urls}
+
+
+class FakeMessage:
+    def __init__(self, destination, message_id):
+        self.destination = destination
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        if self.id in self.destination.gone:
+            raise discord.NotFound(FakeResponse(), 'Unknown Message')
+        self.destination.calls.append(('edit', self.id, kwargs.get('content')))
+
+    async def delete(self):
+        self.destination.calls.append(('delete', self.id))
+
+
+class FakeDestination:
+    def __init__(self):
+        self.calls = []
+        self.gone = set()
+        self.last_message_id = None
+        self._ids = itertools.count(1)
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(self, next(self._ids))
+        self.last_message_id = message.id
+        self.calls.append(('send', message.id, content if 'file' not in kwargs else 'file'))
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+
+def screen_of(*entries):
+    screen = BaseScreen()
+    for entry in entries:
+        if entry.startswith('http'):
+            screen.add(INFO_IMAGE, url=entry, raw=True)
+        else:
+            screen.add(INFO_TEXT, text=entry)
+    return screen
+
+
+def send(screen, destination, published=(), trailing_id=None):
+    destination.calls = []
+    screen.invalidate()
+    return asyncio.new_event_loop().run_until_complete(
+        screen.send(None, destination, FakeImages(), published, trailing_id))
+
+
+def test_first_send_sends_everything():
+    destination = FakeDestination()
+    copy = send(screen_of('a', 'b'), destination)
+    assert destination.calls == [('send', 1, 'a'), ('send', 2, 'b')]
+    assert [message[0] for message in copy] == [1, 2]
+
+
+def test_unchanged_screen_makes_no_calls():
+    destination = FakeDestination()
+    screen = screen_of('a', 'b')
+    copy = send(screen, destination)
+    assert send(screen, destination, copy) == copy
+    assert destination.calls == []
+
+
+def test_changed_entry_is_edited_in_place():
+    destination = FakeDestination()
+    screen = screen_of('a', 'b', 'c')
+    copy = send(screen, destination)
+    screen.elements[1]['options']['text'] = 'B'
+    new_copy = send(screen, destination, copy)
+    assert destination.calls == [('edit', 2, 'B')]
+    assert [message[0] for message in new_copy] == [1, 2, 3]
+
+
+def test_removed_entries_are_deleted():
+    destination = FakeDestination()
+    screen = screen_of('a', 'b', 'c')
+    copy = send(screen, destination)
+    screen.remove(2)
+    assert [message[0] for message in send(screen, destination, copy)] == [1, 2]
+    assert destination.calls == [('delete', 3)]
+
+
+def test_new_entries_are_appended():
+    destination = FakeDestination()
+    screen = screen_of('a')
+    copy = send(screen, destination)
+    screen.add(INFO_TEXT, text='b')
+    send(screen, destination, copy)
+    assert destination.calls == [('send', 2, 'b')]
+
+
+def test_the_command_message_does_not_block_appending():
+    destination = FakeDestination()
+    screen = screen_of('a')
+    copy = send(screen, destination)
+    destination.last_message_id = 99
+    screen.add(INFO_TEXT, text='b')
+    send(screen, destination, copy, trailing_id=99)
+    assert destination.calls == [('send', 2, 'b')]
+
+
+def test_other_messages_after_the_copy_resend_everything():
+    destination = FakeDestination()
+    screen = screen_of('a')
+    copy = send(screen, destination)
+    destination.last_message_id = 99
+    screen.add(INFO_TEXT, text='b')
+    send(screen, destination, copy)
+    assert destination.calls == [('delete', 1), ('send', 2, 'a'), ('send', 3, 'b')]
+
+
+def test_changed_raw_image_resends_from_there():
+    destination = FakeDestination()
+    screen = screen_of('a', 'http://example.com/1.png', 'c')
+    copy = send(screen, destination)
+    screen.elements[1]['options']['url'] = 'http://example.com/2.png'
+    send(screen, destination, copy)
+    assert destination.calls == [('delete', 2), ('delete', 3), ('send', 4, 'file'), ('send', 5, 'c')]
+
+
+def test_deleted_copy_is_replaced():
+    destination = FakeDestination()
+    screen = screen_of('a', 'b')
+    copy = send(screen, destination)
+    destination.gone.add(1)
+    screen.elements[0]['options']['text'] = 'A'
+    new_copy = send(screen, destination, copy)
+    assert destination.calls[-2:] == [('send', 3, 'A'), ('send', 4, 'b')]
+    assert [message[0] for message in new_copy] == [3, 4]
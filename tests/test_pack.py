@@ -0,0 +1,49 @@
+import discord
+
+from infoscreen.rules import MAX_EMBED, Payload, pack
+
+
+def embed(size=10):
+    return discord.Embed(description='x' * size)
+
+
+def embed_counts(messages):
+    return [len(message.embeds) for message in messages]
+
+
+def test_runs_of_embeds_share_messages():
+    payloads = [Payload(embeds=(embed(),)) for _ in range(23)]
+    assert embed_counts(pack(payloads, 10)) == [10, 10, 3]
+
+
+def test_text_is_merged_with_the_embeds_after_it():
+    payloads = [Payload(content='intro')] + [Payload(embeds=(embed(),)) for _ in range(3)]
+    messages = pack(payloads, 10)
+    assert len(messages) == 1
+    assert messages[0].content == 'intro'
+    assert len(messages[0].embeds) == 3
+
+
+def test_text_starts_a_new_message():
+    payloads = [Payload(embeds=(embed(),)), Payload(content='between'), Payload(embeds=(embed(),))]
+    messages = pack(payloads, 10)
+    assert [message.content for message in messages] == [None, 'between']
+    assert embed_counts(messages) == [1, 1]
+
+
+def test_raw_images_are_never_merged():
+    payloads = [Payload(embeds=(embed(),)), Payload(raw_url='https://example.com/a.png'), Payload(embeds=(embed(),))]
+    messages = pack(payloads, 10)
+    assert [message.raw_url for message in messages] == [None, 'https://example.com/a.png', None]
+
+
+def test_total_embed_size_is_respected():
+    payloads = [Payload(embeds=(embed(MAX_EMBED // 2),)) for _ in range(3)]
+    messages = pack(payloads, 10)
+    assert embed_counts(messages) == [2, 1]
+    assert all(sum(len(e) for e in message.embeds) <= MAX_EMBED for message in messages)
+
+
+def test_one_embed_per_message():
+    payloads = [Payload(content='intro')] + [Payload(embeds=(embed(),)) for _ in range(3)]
+    assert embed_counts(pack(payloads, 1)) == [1, 1, 1]
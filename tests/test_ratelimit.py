@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from purge.ratelimit import RateLimiter, WindowBucket
+
+
+def max_in_window(times, period):
+    times = sorted(times)
+    return max(sum(1 for t in times[index:] if t - start < period) for index, start in enumerate(times))
+
+
+def acquire_times(limiter, routes):
+    times = {}
+
+    async def request(route):
+        await limiter.acquire(route)
+        times.setdefault(route, []).append(time.monotonic())
+
+    async def run():
+        await asyncio.gather(*(request(route) for route in routes))
+
+    asyncio.new_event_loop().run_until_complete(run())
+    return times
+
+
+def test_route_window_is_never_exceeded():
+    limiter = RateLimiter(1000, {'delete': (5, 0.2)})
+    times = acquire_times(limiter, [('delete', 1)] * 23)[('delete', 1)]
+    assert len(times) == 23
+    assert max_in_window(times, 0.2) == 5
+
+
+def test_first_window_allows_no_extra_burst():
+    limiter = RateLimiter(1000, {'delete': (5, 0.2)})
+    start = time.monotonic()
+    times = acquire_times(limiter, [('delete', 1)] * 10)[('delete', 1)]
+    assert sum(1 for t in times if t - start < 0.2) == 5
+
+
+def test_routes_have_their_own_limits():
+    limiter = RateLimiter(1000, {'bulk': (1, 0.2), 'history': (3, 0.2)})
+    times = acquire_times(limiter, [('bulk', 1)] * 4 + [('history', 1)] * 7 + [('history', 2)] * 7)
+    assert max_in_window(times[('bulk', 1)], 0.2) == 1
+    assert max_in_window(times[('history', 1)], 0.2) == 3
+    assert max_in_window(times[('history', 2)], 0.2) == 3
+
+
+def test_global_window_is_never_exceeded():
+    limiter = RateLimiter(10, {}, per_route=100, period=1.0, global_period=0.2)
+    times = acquire_times(limiter, [('send', channel_id) for channel_id in range(35)])
+    assert max_in_window([t for route_times in times.values() for t in route_times], 0.2) == 10
+
+
+def test_idle_bucket():
+    bucket = WindowBucket(2, 0.05)
+    assert bucket.is_idle()
+    bucket.consume()
+    assert not bucket.is_idle()
+    assert bucket.wait_time() == 0
+    bucket.consume()
+    assert bucket.wait_time() > 0
+    time.sleep(0.06)
+    assert bucket.is_idle()
@@ -0,0 +1,63 @@
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+
+from purge.schedule import Schedule
+
+
+def run_gaps(schedule, start, count):
+    runs = [schedule.next_run(start)]
+    for _ in range(count):
+        runs.append(schedule.next_run(runs[-1]))
+    return {(b - a) / timedelta(hours=1) for a, b in zip(runs, runs[1:])}
+
+
+@pytest.mark.parametrize('interval', [1, 5, 7, 10, 12, 36, 50])
+def test_runs_are_evenly_spaced(interval):
+    schedule = Schedule(time(3, 30), interval, 'UTC')
+    assert run_gaps(schedule, datetime(2023, 5, 17, 11, 2, tzinfo=timezone.utc), 40) == {interval}
+
+
+@pytest.mark.parametrize('interval', [5, 10, 36])
+def test_runs_do_not_depend_on_the_start(interval):
+    schedule = Schedule(time(3, 30), interval, 'UTC')
+    start = datetime(2023, 5, 17, 11, 2, tzinfo=timezone.utc)
+    runs = [schedule.next_run(start)]
+    for _ in range(20):
+        runs.append(schedule.next_run(runs[-1]))
+    for minutes in range(0, 20 * 60 * interval, 97):
+        assert schedule.next_run(start + timedelta(minutes=minutes)) in runs
+
+
+def test_run_is_strictly_after():
+    schedule = Schedule(time(6, 0), 24, 'UTC')
+    run = datetime(2023, 1, 1, 6, 0, tzinfo=timezone.utc)
+    assert schedule.next_run(run) == run + timedelta(days=1)
+    assert schedule.next_run(run - timedelta(seconds=1)) == run
+
+
+def test_daily_runs_keep_the_wall_clock_across_dst():
+    schedule = Schedule(time(4, 0), 24, 'Europe/Copenhagen')
+    run = schedule.next_run(datetime(2023, 3, 24, tzinfo=timezone.utc))
+    for _ in range(5):
+        local = run.astimezone(schedule.tz)
+        assert (local.hour, local.minute) == (4, 0)
+        run = schedule.next_run(run)
+
+
+def test_multi_day_interval():
+    schedule = Schedule(time(0, 0), 72, 'UTC')
+    assert run_gaps(schedule, datetime(2023, 1, 1, tzinfo=timezone.utc), 10) == {72}
+
+
+def test_invalid_schedules():
+    with pytest.raises(ValueError):
+        Schedule(time(0, 0), 0)
+    with pytest.raises(ValueError):
+        Schedule(time(0, 0), 24, 'Not/AZone')
+
+
+def test_config_round_trip():
+    schedule = Schedule(time(8, 15), 6, 'UTC', jitter=5)
+    copy = Schedule.from_config(schedule.to_config(), time(0, 0))
+    assert copy.to_config() == schedule.to_config()
@@ -0,0 +1,52 @@
+import random
+
+from purge.ephemeral import TimerWheel
+
+
+def expiry_ticks(wheel, start, end):
+    expired = {}
+    for now in range(start + 1, end + 1):
+        for item in wheel.advance(now):
+            expired[item] = now
+    return expired
+
+
+def test_items_expire_at_their_deadline_on_every_level():
+    wheel = TimerWheel(0, slots=4, levels=3)
+    deadlines = {index: deadline for index, deadline in enumerate([1, 3, 4, 5, 15, 16, 17, 63, 64, 65, 200])}
+    for item, deadline in deadlines.items():
+        wheel.add(deadline, item)
+    assert expiry_ticks(wheel, 0, 250) == deadlines
+
+
+def test_random_deadlines():
+    random.seed(0)
+    wheel = TimerWheel(100, slots=8, levels=2)
+    deadlines = {index: random.randint(101, 1000) for index in range(500)}
+    for item, deadline in deadlines.items():
+        wheel.add(deadline, item)
+    assert expiry_ticks(wheel, 100, 1000) == deadlines
+
+
+def test_past_deadlines_expire_on_the_next_tick():
+    wheel = TimerWheel(50)
+    wheel.add(10, 'late')
+    assert wheel.advance(50) == []
+    assert wheel.advance(51) == ['late']
+
+
+def test_advancing_several_ticks_at_once():
+    wheel = TimerWheel(0, slots=4, levels=2)
+    for deadline in [2, 7, 12, 30]:
+        wheel.add(deadline, deadline)
+    assert sorted(wheel.advance(12)) == [2, 7, 12]
+    assert wheel.advance(29) == []
+    assert wheel.advance(40) == [30]
+
+
+def test_items_added_while_running():
+    wheel = TimerWheel(0, slots=4, levels=2)
+    wheel.advance(37)
+    wheel.add(41, 'a')
+    wheel.add(60, 'b')
+    assert expiry_ticks(wheel, 37, 70) == {'a': 41, 'b': 60}